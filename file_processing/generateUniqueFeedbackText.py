@@ -1,28 +1,47 @@
+import argparse
 import json
 import logging
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+import multiprocessing
+import os
+from near_duplicates import NearDuplicateIndex
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
-# Load T5 model and tokenizer
-tokenizer = T5Tokenizer.from_pretrained("t5-small")
-model = T5ForConditionalGeneration.from_pretrained("t5-small")
-
-#Generate paraphrases for a given text.
-def paraphrase_text(text, num_return_sequences=3):
-    input_text = f"{text} </s>"
-    input_ids = tokenizer.encode(input_text, return_tensors="pt", max_length=256, truncation=True)
-    outputs = model.generate(
-        input_ids=input_ids,
-        max_length=256,  # Limiting output length to 256 tokens
-        num_return_sequences=num_return_sequences,
-        num_beams=1,
-        temperature=1.4,
-        top_k=30,
-        top_p=0.70,
-        do_sample=True
-    )
-    return [tokenizer.decode(output, skip_special_tokens=True, clean_up_tokenization_spaces=True) for output in outputs]
+# Loaded once per worker process by init_worker
+tokenizer = None
+model = None
+
+
+def init_worker(model_name, threads):
+    global tokenizer, model
+    import torch
+    from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+    torch.set_num_threads(threads)
+    tokenizer = T5Tokenizer.from_pretrained(model_name)
+    model = T5ForConditionalGeneration.from_pretrained(model_name).eval()
+
+#Generate paraphrases for a batch of texts, num_return_sequences per text.
+def paraphrase_batch(texts, num_return_sequences=3):
+    import torch
+
+    input_texts = [f"{text} </s>" for text in texts]
+    inputs = tokenizer(input_texts, return_tensors="pt", padding=True, max_length=256, truncation=True)
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_length=256,  # Limiting output length to 256 tokens
+            num_return_sequences=num_return_sequences,
+            num_beams=1,
+            temperature=1.4,
+            top_k=30,
+            top_p=0.70,
+            do_sample=True
+        )
+    decoded = tokenizer.batch_decode(outputs, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+    # generate returns the sequences of each input next to each other
+    return [decoded[i * num_return_sequences:(i + 1) * num_return_sequences] for i in range(len(texts))]
 
 #Check if text contains English words.
 def is_english_text(text):
@@ -46,8 +65,8 @@ def clean_paraphrase_structure(paraphrase):
         if not words[0][0].isalpha() or words[0].lower() in {"is", "was", "and", "but", "so", "that"}:
             continue
 
-        # Check for duplicate phrases within the same sentence
-        sentence = ' '.join(sorted(set(sentence.split()), key=sentence.split().index))
+        # Drop repeated words within the same sentence, keeping the first occurrence
+        sentence = ' '.join(dict.fromkeys(words))
 
         # Add valid sentences to the list
         meaningful_sentences.append(sentence.capitalize())
@@ -55,43 +74,106 @@ def clean_paraphrase_structure(paraphrase):
     # Join meaningful sentences back into a single text
     return '. '.join(meaningful_sentences) + '.' if meaningful_sentences else None
 
-logging.info(f"Started processing feedback data.")
-
-input_file = 'inputFile1.json'
-output_file = 'feedback_input_text_unique_variations.json'
-
-with open(input_file, 'r') as file:
-    feedback_data = json.load(file)
-
-logging.info(f"Loaded {len(feedback_data)} feedback entries.")
-
-# Generate unique feedback
-unique_feedback_data = []
-seen_texts = set()
-
-for idx, feedback in enumerate(feedback_data):
-    if idx % 500 == 0:  # Log progress every 500 entries
-        logging.info(f"Processing feedback {idx + 1}/{len(feedback_data)}")
-    original_text = feedback["text"]
-    paraphrases = paraphrase_text(original_text, num_return_sequences=5)
-
-    unique_paraphrases = []  # Initialize the list to store unique paraphrases
-
-    for paraphrase in paraphrases:
-        # Clean and validate the paraphrase
-        cleaned_paraphrase = clean_paraphrase_structure(paraphrase)
-        if cleaned_paraphrase and cleaned_paraphrase not in seen_texts:
-            seen_texts.add(cleaned_paraphrase)
-            unique_paraphrases.append(cleaned_paraphrase)
-        if len(unique_paraphrases) >= 3:  # Stop once 3 unique paraphrases are found
-            break
-
-    # Add the 3 unique paraphrases to the result
-    for unique_paraphrase in unique_paraphrases:
-        unique_feedback_data.append({"text": unique_paraphrase, "stars": feedback["stars"]})
-
-# Save the updated feedback
-with open(output_file, 'w') as outfile:
-    json.dump(unique_feedback_data, outfile, indent=4)
-
-logging.info(f"Unique paraphrased feedback saved to {output_file}")
+# Worker task: (start index, entries) -> (start index, entries, cleaned paraphrases per entry)
+def process_batch(task):
+    start, entries, num_return_sequences = task
+    paraphrases = paraphrase_batch([feedback["text"] for feedback in entries], num_return_sequences)
+    cleaned = [[text for text in map(clean_paraphrase_structure, candidates) if text] for candidates in paraphrases]
+    return start, entries, cleaned
+
+# The checkpoint records how many input entries are done and how many output bytes belong to them,
+# so a resumed run truncates any partially written batch and continues with the next entry.
+def load_checkpoint(checkpoint_file):
+    if not os.path.exists(checkpoint_file):
+        return {"next_idx": 0, "offset": 0}
+    with open(checkpoint_file, 'r') as file:
+        return json.load(file)
+
+def save_checkpoint(checkpoint_file, next_idx, offset):
+    with open(f"{checkpoint_file}.tmp", 'w') as file:
+        json.dump({"next_idx": next_idx, "offset": offset}, file)
+    os.replace(f"{checkpoint_file}.tmp", checkpoint_file)
+
+def load_seen_texts(output_file, offset, seen_texts):
+    if os.path.exists(output_file):
+        with open(output_file, 'rb') as file:
+            for line in file.read(offset).splitlines():
+                if line.strip():
+                    seen_texts.add_if_unique(json.loads(line)["text"])
+    return seen_texts
+
+# Convert the JSONL output to the JSON array format read by the k6 load test
+def export_json(output_file, json_file):
+    with open(output_file, 'r') as infile, open(json_file, 'w') as outfile:
+        outfile.write("[\n")
+        first = True
+        for line in infile:
+            if line.strip():
+                outfile.write(("" if first else ",\n") + "    " + line.strip())
+                first = False
+        outfile.write("\n]\n")
+    logging.info(f"Exported {output_file} to {json_file}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate unique paraphrased feedback for synthetic load.")
+    parser.add_argument("--input", default='inputFile1.json', help="JSON array of {text, stars} entries")
+    parser.add_argument("--output", default='feedback_input_text_unique_variations.jsonl')
+    parser.add_argument("--export-json", help="Also write the result as a JSON array to this path")
+    parser.add_argument("--model", default="t5-small")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=16, help="Entries per generate call")
+    parser.add_argument("--candidates", type=int, default=5, help="Paraphrases sampled per entry")
+    parser.add_argument("--keep", type=int, default=3, help="Unique paraphrases kept per entry")
+    parser.add_argument("--similarity-threshold", type=float, default=0.8,
+                        help="Paraphrases this similar (Jaccard of word shingles) to an earlier one are dropped")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from scratch")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.info(f"Started processing feedback data.")
+
+    with open(args.input, 'r') as file:
+        feedback_data = json.load(file)
+    logging.info(f"Loaded {len(feedback_data)} feedback entries.")
+
+    checkpoint_file = f"{args.output}.checkpoint"
+    checkpoint = {"next_idx": 0, "offset": 0} if args.restart else load_checkpoint(checkpoint_file)
+    next_idx = checkpoint["next_idx"]
+    seen_texts = load_seen_texts(args.output, checkpoint["offset"], NearDuplicateIndex(args.similarity_threshold))
+    if next_idx:
+        logging.info(f"Resuming at feedback {next_idx + 1}/{len(feedback_data)}")
+
+    tasks = ((start, feedback_data[start:start + args.batch_size], args.candidates)
+             for start in range(next_idx, len(feedback_data), args.batch_size))
+    with open(args.output, 'ab') as outfile, multiprocessing.Pool(
+            args.workers, initializer=init_worker, initargs=(args.model, args.threads_per_worker)) as pool:
+        # Drop output written after the last checkpoint
+        outfile.truncate(checkpoint["offset"])
+        outfile.seek(checkpoint["offset"])
+        # imap keeps input order, so everything before next_idx is always complete
+        for start, entries, cleaned in pool.imap(process_batch, tasks):
+            lines = []
+            for feedback, paraphrases in zip(entries, cleaned):
+                unique_paraphrases = []
+                for paraphrase in paraphrases:
+                    if seen_texts.add_if_unique(paraphrase):
+                        unique_paraphrases.append(paraphrase)
+                    if len(unique_paraphrases) >= args.keep:  # Stop once enough unique paraphrases are found
+                        break
+                lines.extend(json.dumps({"text": text, "stars": feedback["stars"]}) + "\n" for text in unique_paraphrases)
+            outfile.write("".join(lines).encode("utf-8"))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+            next_idx = start + len(entries)
+            save_checkpoint(checkpoint_file, next_idx, outfile.tell())
+            if start // args.batch_size % 50 == 0:  # Log progress every 50 batches
+                logging.info(f"Processed feedback {next_idx}/{len(feedback_data)}, {len(seen_texts)} unique paraphrases")
+
+    logging.info(f"Unique paraphrased feedback saved to {args.output}")
+    if args.export_json:
+        export_json(args.output, args.export_json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import json
+import logging
+import re
+import zlib
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+#Word n-gram shingles of the lowercased text; texts shorter than n words become a single shingle.
+def shingles(text, n=3):
+    words = TOKEN_PATTERN.findall(text.lower())
+    if len(words) <= n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+#Pick (bands, rows) with bands * rows <= num_perm whose S-curve midpoint (1/bands)^(1/rows) is closest to the threshold.
+def lsh_params(threshold, num_perm):
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+# MinHash signatures bucketed by LSH bands. Texts whose estimated Jaccard similarity of word
+# shingles with an indexed text reaches the threshold are reported as near-duplicates.
+class NearDuplicateIndex:
+    def __init__(self, threshold=0.8, num_perm=64, shingle_size=3, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        generator = np.random.RandomState(seed)
+        # a * x + b stays below 2^63 for 32-bit shingle hashes, so uint64 arithmetic is exact
+        self.a = generator.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = []
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text, self.shingle_size)),
+                             dtype=np.uint64)
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def find(self, signature, keys):
+        candidates = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        for candidate in candidates:
+            if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                return candidate
+        return None
+
+    def insert(self, signature, keys):
+        doc_id = len(self.signatures)
+        self.signatures.append(signature)
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(doc_id)
+
+    #Index the text unless it is a near-duplicate of one already indexed; returns True if it was added.
+    def add_if_unique(self, text):
+        signature = self.signature(text)
+        keys = self.band_keys(signature)
+        if self.find(signature, keys) is not None:
+            return False
+        self.insert(signature, keys)
+        return True
+
+# Stream a JSONL file of {"text": ...} records, keeping the first of every group of near-duplicates
+def filter_jsonl(input_file, output_file, index):
+    kept = 0
+    total = 0
+    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
+        for line in infile:
+            if not line.strip():
+                continue
+            total += 1
+            if index.add_if_unique(json.loads(line)["text"]):
+                outfile.write(line if line.endswith("\n") else line + "\n")
+                kept += 1
+            if total % 10000 == 0:
+                logging.info(f"Filtered {total} records, kept {kept}")
+    logging.info(f"Kept {kept} of {total} records from {input_file} in {output_file}")
+    return kept, total
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Drop near-duplicate feedback from a JSONL file, e.g. a captured inputFile.jsonl.")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity at which texts count as duplicates")
+    parser.add_argument("--num-perm", type=int, default=64, help="MinHash permutations")
+    parser.add_argument("--shingle-size", type=int, default=3, help="Words per shingle")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    index = NearDuplicateIndex(args.threshold, args.num_perm, args.shingle_size)
+    logging.info(f"LSH with {index.bands} bands of {index.rows} rows for threshold {args.threshold}")
+    filter_jsonl(args.input, args.output, index)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Micro-batching window
+MAX_BATCH_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+# Requests admitted (queued or in a running batch) at once, 0 for unbounded
+MAX_QUEUE_DEPTH = int(os.environ.get("BATCH_MAX_QUEUE_DEPTH", "256"))
+
+# Job priorities, lowest served first: control calls run on the scheduler thread between
+# batches, interactive requests are batched together, bulk work runs in passes of its own
+# whenever no interactive request is waiting
+CONTROL = 0
+INTERACTIVE = 1
+BULK = 2
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class BatchJob:
+    # `deadline` is a time.perf_counter() value after which the result is no longer wanted
+    def __init__(self, item, deadline=None, priority=INTERACTIVE):
+        self.item = item
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.deadline = deadline
+        self.priority = priority
+        self.sequence = None
+
+
+# Collects concurrent requests into a single forward pass. `forward` receives the
+# list of submitted items and must return one result per item, in the same order.
+# All forward passes, bulk ones included, run on the scheduler thread one at a time.
+class BatchScheduler:
+    def __init__(self, forward, logger, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_queue_depth=MAX_QUEUE_DEPTH):
+        self.forward = forward
+        self.logger = logger
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue_depth = max_queue_depth
+        self.pending = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.depth = 0
+        self.depth_lock = threading.Lock()
+        self.worker = None
+
+    # Threads do not survive a fork, so workers start once the serving process is up
+    def start(self):
+        self.worker = threading.Thread(target=self.run, name="batch-scheduler", daemon=True)
+        self.worker.start()
+
+    def is_full(self):
+        return 0 < self.max_queue_depth <= self.depth
+
+    # Returns (result, batch_size, queue_wait_ms) once the batch containing the item has run.
+    # Raises QueueFullError when max_queue_depth requests are already admitted, and
+    # DeadlineExceededError when the deadline passes before the item reaches the model.
+    def submit(self, item, deadline=None):
+        with self.depth_lock:
+            if self.is_full():
+                raise QueueFullError(f"{self.depth} requests already queued for inference.")
+            self.depth += 1
+        try:
+            job = BatchJob(item, deadline)
+            self.enqueue(job)
+            return job.future.result()
+        finally:
+            with self.depth_lock:
+                self.depth -= 1
+
+    # Forward a list of items as one pass once no interactive request is waiting. Bulk work does
+    # not count towards max_queue_depth; returns (results, batch_size, queue_wait_ms).
+    def submit_bulk(self, items):
+        job = BatchJob(list(items), priority=BULK)
+        self.enqueue(job)
+        return job.future.result()
+
+    # Run `function` on the scheduler thread between batches and return its result, e.g. to
+    # start a profiler that only records the thread it was started on
+    def call(self, function):
+        job = BatchJob(function, priority=CONTROL)
+        self.enqueue(job)
+        return job.future.result()
+
+    # Jobs keep their sequence number when put back, so equal priorities stay first in, first out
+    def enqueue(self, job):
+        if job.sequence is None:
+            job.sequence = next(self.sequence)
+        self.pending.put((job.priority, job.sequence, job))
+
+    def next_job(self, timeout=None):
+        if timeout is not None and timeout <= 0:
+            return self.pending.get_nowait()[2]
+        return self.pending.get(timeout=timeout)[2]
+
+    def collect_batch(self):
+        first = self.next_job()
+        if first.priority != INTERACTIVE:
+            return [first]
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                job = self.next_job(deadline - time.perf_counter())
+            except queue.Empty:
+                break
+            if job.priority != INTERACTIVE:
+                self.enqueue(job)
+                break
+            batch.append(job)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect_batch()
+            started = time.perf_counter()
+            # Nobody is waiting for expired requests any more, so they never reach the model
+            expired = [job for job in batch if job.deadline is not None and job.deadline <= started]
+            for job in expired:
+                job.future.set_exception(DeadlineExceededError("Request deadline passed while queued."))
+            if expired:
+                batch = [job for job in batch if not job.future.done()]
+                if not batch:
+                    continue
+            if batch[0].priority == CONTROL:
+                self.run_control(batch[0])
+                continue
+            if batch[0].priority == BULK:
+                self.run_bulk(batch[0], started)
+                continue
+            try:
+                results = self.forward([job.item for job in batch])
+            except Exception as e:
+                self.logger.error(f"Batched inference failed for {len(batch)} requests.", exc_info=True)
+                for job in batch:
+                    job.future.set_exception(e)
+                continue
+            for job, result in zip(batch, results):
+                queue_wait_ms = (started - job.enqueued_at) * 1000
+                job.future.set_result((result, len(batch), queue_wait_ms))
+
+    @staticmethod
+    def run_control(job):
+        try:
+            job.future.set_result(job.item())
+        except Exception as e:
+            job.future.set_exception(e)
+
+    def run_bulk(self, job, started):
+        try:
+            results = self.forward(job.item)
+        except Exception as e:
+            self.logger.error(f"Bulk inference failed for {len(job.item)} items.", exc_info=True)
+            job.future.set_exception(e)
+            return
+        job.future.set_result((results, len(job.item), (started - job.enqueued_at) * 1000))
@@ -0,0 +1,285 @@
+# In-process benchmark of the inference path: replays recorded feedback straight into
+# FeedbackAnalysis (no network, no S3) and writes a JSON report that can be diffed between commits.
+#
+#   python benchmark.py --model-dir ~/s3/inference/models/<version> --output report.json
+#   python benchmark.py --model-dir ... --baseline report.json   # exits 1 on a regression
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# Read by the serving modules at import time: no trace export, and no cache so every
+# replayed request runs the model
+os.environ.setdefault("MODE", "benchmark")
+os.environ.setdefault("CACHE_MAX_ENTRIES", "0")
+
+from fastapi import FastAPI
+from feedback_analysis import FeedbackAnalysis
+from feedback_request_model import FeedbackRequest
+from local_s3 import LocalS3Client
+from model_store import ModelStore
+import metrics
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REPLAY_FILES = [os.path.join(REPO_ROOT, "file_processing", f"inputFile{i}.json") for i in (1, 2, 3)]
+BENCHMARK_BUCKET = "benchmark"
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+# Replay files are either a JSON array or JSONL of {"text": ..., "stars": ...} records
+def load_records(paths, limit):
+    records = []
+    for path in paths:
+        with open(path, "r") as f:
+            if path.endswith(".jsonl"):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = json.load(f)
+        records.extend({"text": row["text"], "stars": int(row["stars"])} for row in rows
+                       if isinstance(row, dict) and "text" in row and "stars" in row)
+        if len(records) >= limit:
+            break
+    return records[:limit]
+
+
+# Stretch or cut every text to a fixed number of words; 0 keeps the recorded text
+def with_text_length(records, words):
+    if words == 0:
+        return records
+    resized = []
+    for record in records:
+        tokens = record["text"].split() or ["ok"]
+        tokens = (tokens * (words // len(tokens) + 1))[:words]
+        resized.append({"text": " ".join(tokens), "stars": record["stars"]})
+    return resized
+
+
+# Nearest-rank percentile
+def percentile(sorted_values, pct):
+    rank = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+# Peak over the whole process lifetime, reported once per run
+def process_peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Highest current RSS seen between start() and stop(), so each scenario reports its own peak
+class RssSampler:
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def start(self):
+        self.peak = metrics.resident_memory_bytes()
+        self.worker = threading.Thread(target=self.run, name="rss-sampler", daemon=True)
+        self.worker.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, metrics.resident_memory_bytes())
+
+    def stop(self):
+        self.stopped.set()
+        self.worker.join()
+        self.peak = max(self.peak, metrics.resident_memory_bytes())
+        return self.peak
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_feedback_analysis(model_dir, work_dir, logger):
+    model, tokenizer, load_ms = ModelStore.load(model_dir)
+    version = os.path.basename(os.path.normpath(model_dir))
+    feedback_analysis = FeedbackAnalysis(
+        app=FastAPI(), segment_dir=os.path.join(work_dir, "segments"), logger=logger,
+        model=model, tokenizer=tokenizer, s3_client=LocalS3Client(os.path.join(work_dir, "s3")),
+        s3_bucket=BENCHMARK_BUCKET, new_data_path="datasets/", device="cpu", model_version=version,
+        model_dir=model_dir, startup_timings={"load_ms": load_ms})
+    feedback_analysis.start_background_workers()
+    return feedback_analysis
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3)
+    }
+
+
+def run_scenario(feedback_analysis, records, concurrency, batch_size, text_length, requests, warmup):
+    feedback_analysis.scheduler.max_batch_size = batch_size
+    replay = with_text_length(records, text_length)
+    requests_to_send = [FeedbackRequest(**replay[i % len(replay)]) for i in range(warmup + requests)]
+
+    # Returns (latency_ms, batch_size, queue_wait_ms), or None for a failed request
+    def send(feedback):
+        response = SimpleNamespace(headers={})
+        start = time.perf_counter()
+        try:
+            feedback_analysis.analyze(feedback, response)
+        except Exception:
+            return None
+        latency_ms = (time.perf_counter() - start) * 1000
+        return latency_ms, int(response.headers["X-Batch-Size"]), float(response.headers["X-Queue-Wait-Ms"])
+
+    rss_sampler = RssSampler()
+    rss_sampler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, requests_to_send[:warmup]))
+            started = time.perf_counter()
+            results = list(pool.map(send, requests_to_send[warmup:]))
+            duration = time.perf_counter() - started
+    finally:
+        peak_rss = rss_sampler.stop()
+
+    completed = [result for result in results if result is not None]
+    return {
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "text_length": text_length,
+        "requests": requests,
+        "errors": len(results) - len(completed),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(completed) / duration, 2) if duration > 0 else None,
+        "latency_ms": summarize([latency for latency, _, _ in completed]),
+        "queue_wait_ms": summarize([queue_wait for _, _, queue_wait in completed]),
+        "mean_batch_size": round(sum(size for _, size, _ in completed) / len(completed), 2) if completed else None,
+        "peak_rss_bytes": peak_rss
+    }
+
+
+def scenario_key(scenario):
+    return scenario["concurrency"], scenario["batch_size"], scenario["text_length"]
+
+
+# Scenarios whose throughput dropped or p95 latency grew by more than `tolerance` against the baseline
+def find_regressions(report, baseline, tolerance):
+    previous = {scenario_key(scenario): scenario for scenario in baseline["scenarios"]}
+    regressions = []
+    for scenario in report["scenarios"]:
+        before = previous.get(scenario_key(scenario))
+        if before is None:
+            continue
+        checks = [
+            ("throughput_rps", before["throughput_rps"], scenario["throughput_rps"], -1),
+            ("p95_latency_ms", before["latency_ms"]["p95"], scenario["latency_ms"]["p95"], 1)
+        ]
+        for name, old, new, direction in checks:
+            if old and new is not None and direction * (new - old) / old > tolerance:
+                regressions.append({
+                    "concurrency": scenario["concurrency"],
+                    "batch_size": scenario["batch_size"],
+                    "text_length": scenario["text_length"],
+                    "metric": name,
+                    "baseline": old,
+                    "current": new
+                })
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the in-process inference path.")
+    parser.add_argument("--model-dir", required=True, help="Local directory holding a saved model and tokenizer")
+    parser.add_argument("--replay", nargs="+", default=DEFAULT_REPLAY_FILES,
+                        help="JSON or JSONL files of {text, stars} records to replay")
+    parser.add_argument("--max-records", type=int, default=5000)
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 8, 32])
+    parser.add_argument("--batch-sizes", type=parse_int_list, default=[1, 8, 16, 32])
+    parser.add_argument("--text-lengths", type=parse_int_list, default=[0, 16, 128, 384],
+                        help="Words per text, 0 replays the recorded texts unchanged")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests before each scenario")
+    parser.add_argument("--output", default="-", help="Report path, - for stdout")
+    parser.add_argument("--baseline", help="Previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative throughput drop or p95 growth before failing")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("benchmark")
+    records = load_records(args.replay, args.max_records)
+    if not records:
+        sys.exit("No {text, stars} records found in the replay files.")
+
+    with tempfile.TemporaryDirectory(prefix="feedback-benchmark-") as work_dir:
+        rss_before_load = metrics.resident_memory_bytes()
+        feedback_analysis = build_feedback_analysis(args.model_dir, work_dir, logger)
+        serving = feedback_analysis.serving
+        report = {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "model_version": serving.version,
+            "backend": serving.backend.name,
+            "replay_records": len(records),
+            "startup_timings_ms": serving.timings,
+            "model_rss_bytes": metrics.resident_memory_bytes() - rss_before_load,
+            "scenarios": []
+        }
+        for text_length in args.text_lengths:
+            for batch_size in args.batch_sizes:
+                for concurrency in args.concurrency:
+                    scenario = run_scenario(feedback_analysis, records, concurrency, batch_size, text_length,
+                                            args.requests, args.warmup)
+                    logger.warning(f"concurrency={concurrency} batch_size={batch_size} text_length={text_length}: "
+                                   f"{scenario['throughput_rps']} req/s, p95 {scenario['latency_ms']['p95']} ms")
+                    report["scenarios"].append(scenario)
+        report["peak_rss_bytes"] = process_peak_rss_bytes()
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        report["baseline_commit"] = baseline.get("commit")
+        report["regressions"] = find_regressions(report, baseline, args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if report.get("regressions"):
+        logger.error(f"{len(report['regressions'])} regressions against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
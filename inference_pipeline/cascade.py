@@ -0,0 +1,55 @@
+import os
+
+# Optional first stage answering clear-cut feedback without the transformer: off | vader
+CASCADE_MODE = os.environ.get("CASCADE_MODE", "off")
+# Minimum |VADER compound| for the first stage to answer, when the star rating agrees
+CASCADE_MIN_CONFIDENCE = float(os.environ.get("CASCADE_MIN_CONFIDENCE", "0.6"))
+
+
+# Same bins the trainer uses to relabel with VADER
+def vader_label(compound):
+    if compound < -0.5:
+        return 0
+    if compound < -0.1:
+        return 1
+    if compound <= 0.1:
+        return 2
+    if compound <= 0.5:
+        return 3
+    return 4
+
+
+# Answers only when VADER is confident and points the same way as the stars: strongly
+# positive text with 4-5 stars or strongly negative text with 1-2 stars. Everything else
+# (neutral, mixed, or text contradicting the rating) is left to the model.
+class VaderStage:
+    name = "vader"
+
+    def __init__(self, min_confidence=CASCADE_MIN_CONFIDENCE):
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+        self.analyzer = SentimentIntensityAnalyzer()
+        self.min_confidence = min_confidence
+
+    def score(self, text):
+        return self.analyzer.polarity_scores(text)["compound"]
+
+    @staticmethod
+    def decide(compound, stars, min_confidence):
+        if compound >= min_confidence and stars >= 4:
+            return vader_label(compound)
+        if compound <= -min_confidence and stars <= 2:
+            return vader_label(compound)
+        return None
+
+    # Predicted class, or None to escalate to the model
+    def predict(self, text, stars):
+        return VaderStage.decide(self.score(text), stars, self.min_confidence)
+
+
+def create_cascade(mode=CASCADE_MODE):
+    if mode == "off":
+        return None
+    if mode == "vader":
+        return VaderStage()
+    raise ValueError(f"Unknown cascade mode: {mode}")
@@ -0,0 +1,101 @@
+# Offline check of the cascade's first stage against the full model: for each confidence
+# threshold, how much traffic the first stage would answer and how often it agrees with the model.
+#
+#   python cascade_eval.py --model-dir ~/s3/inference/models/<version> --thresholds 0.5,0.6,0.7
+import argparse
+import json
+import logging
+import os
+from collections import Counter
+
+from benchmark import DEFAULT_REPLAY_FILES, load_records
+from cascade import VaderStage
+from feedback_analysis import FeedbackAnalysis
+from model_store import ModelStore
+from serving_model import ServingModel
+
+EVAL_BATCH_SIZE = 64
+
+
+def parse_float_list(value):
+    return [float(v) for v in value.split(",") if v]
+
+
+# Full-model class for every text, scored in length-sorted batches
+def model_predictions(serving, texts):
+    input_ids = serving.encode_texts(texts)
+    order = sorted(range(len(texts)), key=lambda idx: len(input_ids[idx]))
+    predictions = [None] * len(texts)
+    for start in range(0, len(order), EVAL_BATCH_SIZE):
+        batch = order[start:start + EVAL_BATCH_SIZE]
+        for idx, prediction in zip(batch, serving.predict_batch([input_ids[idx] for idx in batch])):
+            predictions[idx] = prediction
+    return predictions
+
+
+def evaluate(records, compounds, predictions, min_confidence):
+    answered = 0
+    label_agree = 0
+    sentiment_agree = 0
+    disagreements = Counter()
+    for record, compound, prediction in zip(records, compounds, predictions):
+        cascaded = VaderStage.decide(compound, record["stars"], min_confidence)
+        if cascaded is None:
+            continue
+        answered += 1
+        label_agree += cascaded == prediction
+        # What the client sees is the overall sentiment, which folds in the stars
+        cascaded_sentiment = FeedbackAnalysis.score_feedback(cascaded, record["stars"])[2]
+        model_sentiment = FeedbackAnalysis.score_feedback(prediction, record["stars"])[2]
+        sentiment_agree += cascaded_sentiment == model_sentiment
+        if cascaded_sentiment != model_sentiment:
+            disagreements[f"{cascaded_sentiment} -> {model_sentiment}"] += 1
+    return {
+        "min_confidence": min_confidence,
+        "answered_by_first_stage": answered,
+        "first_stage_ratio": round(answered / len(records), 4) if records else None,
+        "label_agreement": round(label_agree / answered, 4) if answered else None,
+        "overall_sentiment_agreement": round(sentiment_agree / answered, 4) if answered else None,
+        "disagreements": dict(disagreements.most_common(10))
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure cascade first-stage agreement with the full model.")
+    parser.add_argument("--model-dir", required=True, help="Local directory holding a saved model and tokenizer")
+    parser.add_argument("--replay", nargs="+", default=DEFAULT_REPLAY_FILES,
+                        help="JSON or JSONL files of {text, stars} records")
+    parser.add_argument("--max-records", type=int, default=5000)
+    parser.add_argument("--thresholds", type=parse_float_list, default=[0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--output", default="-", help="Report path, - for stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("cascade_eval")
+    records = load_records(args.replay, args.max_records)
+
+    model, tokenizer, _ = ModelStore.load(args.model_dir)
+    version = os.path.basename(os.path.normpath(args.model_dir))
+    serving = ServingModel(model, tokenizer, version, args.model_dir, "cpu", logger, backend_name="fp32")
+    predictions = model_predictions(serving, [record["text"] for record in records])
+    stage = VaderStage()
+    compounds = [stage.score(record["text"]) for record in records]
+
+    report = {
+        "model_version": version,
+        "records": len(records),
+        "thresholds": [evaluate(records, compounds, predictions, threshold) for threshold in args.thresholds]
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
 from feedback_request_model import FeedbackRequest
 from feedback_response_model import FeedbackResponse
-from fastapi import FastAPI, HTTPException
+from batch_scheduler import MAX_QUEUE_DEPTH, BatchScheduler, DeadlineExceededError, QueueFullError
+from inference_cache import InferenceCache
+from feedback_writer import FeedbackWriter
+from segment_uploader import SegmentUploader
+from serving_model import ServingModel
+from model_reloader import ModelReloader
+from cascade import create_cascade
+from profiling import ADMIN_TOKEN, Profiler, ProfileInProgressError
+import metrics
+from anyio import CapacityLimiter, to_thread
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 import time
-import torch
+import hmac
 import json
-import queue
+import math
 import os
+import socket
+from typing import Optional
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
     OTLPSpanExporter as OTLPSpanExporterHTTP,
@@ -13,11 +27,11 @@ from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
 # Sentiment labels
 sentiment_labels = {0: "Very Negative", 1: "Negative", 2: "Neutral", 3: "Positive", 4: "Very Positive"}
-feedback_queue = queue.Queue()
 OTLP_HTTP_ENDPOINT = os.environ.get(
     "OTLP_HTTP_ENDPOINT", "http://172.22.229.100:4318/v1/traces"
 )
@@ -25,48 +39,170 @@ OTLP_HTTP_ENDPOINT = os.environ.get(
 MODE = os.environ.get("MODE", "otlp-http")
 TARGET_ONE_HOST = os.environ.get("TARGET_ONE_HOST", "inference-helper-service")
 OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "feedback-inference-service")
+# Fraction of new traces recorded; requests continuing a sampled upstream trace are always recorded
+OTEL_TRACES_SAMPLER_RATIO = float(os.environ.get("OTEL_TRACES_SAMPLER_RATIO", "1.0"))
+# Bulk scoring: items scored per chunk and per vectorized forward pass
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "1024"))
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "64"))
+# Bulk requests scored at once; further bulk requests wait without holding a thread
+BULK_MAX_CONCURRENCY = int(os.environ.get("BULK_MAX_CONCURRENCY", "2"))
+# Sent with 429/503 responses when requests are shed
+RETRY_AFTER_SECONDS = os.environ.get("RETRY_AFTER_SECONDS", "1")
 
 class FeedbackAnalysis:
-    def __init__(self, app: FastAPI, new_data_file_local, logger, model, tokenizer, s3_client, s3_bucket, new_data_path, device):
+    def __init__(self, app: FastAPI, segment_dir, logger, model, tokenizer, s3_client, s3_bucket, new_data_path, device, model_version="unknown", model_dir=None, startup_timings=None, model_store=None):
         self.app = app
-        self.new_data_file_local = new_data_file_local
+        self.segment_dir = segment_dir
         self.logger = logger
-        self.model = model
-        self.tokenizer = tokenizer
         self.s3_client = s3_client
         self.S3_BUCKET = s3_bucket
         self.NEW_DATA_PATH = new_data_path
         self.device = device
+        serving = self.build_serving(model, tokenizer, model_version, model_dir)
+        # Phase timings in ms: list, download and load come from the caller
+        serving.timings = {**(startup_timings or {}), **serving.timings}
+        self.logger.info(f"Startup timings (ms): {serving.timings}")
+        # Newer published versions are loaded and swapped in by the reloader
+        self.model_reloader = ModelReloader(model_store, self.build_serving, serving, logger)
+        metrics.record_serving_model(serving)
+        self.cache = InferenceCache()
+        # Optional cheap first stage answering clear-cut feedback before the model
+        self.cascade = create_cascade()
+        self.scheduler = BatchScheduler(self.predict_scheduled, logger)
+        self.profiler = Profiler(logger, self.scheduler)
+        # Interactive requests admitted and not yet answered, including those waiting for a
+        # thread; only touched on the event loop
+        self.in_flight = 0
+        # Inference and bulk scoring run on thread limiters of their own, so requests waiting for
+        # them never hold up /metrics and the other endpoints on the shared threadpool
+        self.inference_limiter = None
+        self.bulk_limiter = None
+        # Captured data is stored under a per-pod key so pods never overwrite each other
+        capture_pod_name = os.getenv("POD_NAME") or socket.gethostname()
+        self.feedback_writer = FeedbackWriter(self.segment_dir, logger, capture_pod_name)
+        self.segment_uploader = SegmentUploader(s3_client, s3_bucket, new_data_path, self.segment_dir, logger,
+                                                capture_pod_name, self.feedback_writer.seal)
+        self.gauge_sampler = metrics.GaugeSampler([
+            (metrics.SCHEDULER_QUEUE_DEPTH, self.scheduler.pending.qsize),
+            (metrics.CAPTURE_QUEUE_DEPTH, self.feedback_writer.queue.qsize),
+            (metrics.REQUESTS_IN_FLIGHT, lambda: self.in_flight)
+        ], logger)
         self.initialize_routes()
         setting_jaeger(self.app)
 
+    def start_background_workers(self):
+        # Samples written before a fork are reset in the forked worker's multiprocess file
+        metrics.record_serving_model(self.serving)
+        self.gauge_sampler.start()
+        self.scheduler.start()
+        self.feedback_writer.start()
+        self.segment_uploader.start()
+        self.model_reloader.start()
+
+    # Worker threads are daemons; on shutdown (SIGTERM, including a worker recycled onto a new
+    # model) write out what is still queued, seal the open segment and try one last upload.
+    # Segments that fail to upload stay on disk for the next process in this directory.
+    def stop_background_workers(self):
+        try:
+            self.feedback_writer.seal()
+        except Exception:
+            self.logger.error("Failed to seal captured feedback on shutdown.", exc_info=True)
+            return
+        try:
+            self.segment_uploader.upload_pending()
+        except Exception:
+            self.logger.error("Failed to upload feedback segments on shutdown.", exc_info=True)
+
     def initialize_routes(self):
+        # Runs in every serving process, including workers forked from a preloading master
+        @self.app.on_event("startup")
+        async def start_background_workers():
+            # Limiters belong to the event loop, so they are created once it runs
+            self.inference_limiter = CapacityLimiter(MAX_QUEUE_DEPTH if MAX_QUEUE_DEPTH > 0 else math.inf)
+            self.bulk_limiter = CapacityLimiter(BULK_MAX_CONCURRENCY)
+            self.start_background_workers()
+
+        @self.app.on_event("shutdown")
+        async def stop_background_workers():
+            await to_thread.run_sync(self.stop_background_workers)
+
+        # X-Request-Timeout is the client's remaining budget in ms. Admission is decided on the
+        # event loop against every admitted request, so a full queue is rejected before the
+        # request waits for a thread.
         @self.app.post("/feedback/analyse", response_model=FeedbackResponse)
-        def analyze(feedback:FeedbackRequest):
-            return self.analyze(feedback)
+        async def analyze(feedback:FeedbackRequest, response: Response,
+                          x_request_timeout: Optional[float] = Header(None)):
+            deadline = time.perf_counter() + x_request_timeout / 1000 if x_request_timeout else None
+            if 0 < MAX_QUEUE_DEPTH <= self.in_flight:
+                self.shed_request("queue_full")
+            self.in_flight += 1
+            try:
+                return await to_thread.run_sync(self.analyze, feedback, response, deadline,
+                                                limiter=self.inference_limiter)
+            finally:
+                self.in_flight -= 1
+
+        @self.app.post("/feedback/analyse/bulk")
+        async def analyze_bulk(request: Request):
+            return StreamingResponse(self.analyze_bulk(request), media_type="application/x-ndjson")
+
+        @self.app.get("/model/info")
+        def model_info():
+            return self.model_info()
+
+        # Under gunicorn the master rolls back and recycles the workers, so the request is accepted
+        # and this worker is replaced shortly after
+        @self.app.post("/model/rollback")
+        def rollback_model(x_admin_token: Optional[str] = Header(None)):
+            FeedbackAnalysis.require_admin(x_admin_token)
+            try:
+                if self.model_reloader.delegates_to_master:
+                    version = self.model_reloader.request_rollback()
+                    return JSONResponse(status_code=202, content={**self.model_info(), "rolling_back_to": version})
+                version = self.model_reloader.rollback()
+            except ValueError as ex:
+                raise HTTPException(status_code=409, detail=str(ex))
+            return {**self.model_info(), "rolled_back_to": version}
+
+        @self.app.get("/cache/stats")
+        def cache_stats():
+            return self.cache.stats()
+
+        @self.app.get("/feedback/capture/stats")
+        def capture_stats():
+            return {**self.feedback_writer.stats(), **self.segment_uploader.stats()}
+
+        @self.app.get("/metrics")
+        def prometheus_metrics():
+            content, content_type = metrics.render()
+            return Response(content=content, media_type=content_type)
+
+        # Time-boxed profile of live traffic as a zip of torch trace, folded stacks and allocation stats
+        @self.app.post("/admin/profile")
+        def capture_profile(seconds: float = 10.0, x_admin_token: Optional[str] = Header(None)):
+            FeedbackAnalysis.require_admin(x_admin_token)
+            try:
+                archive = self.profiler.capture(seconds)
+            except ProfileInProgressError as ex:
+                raise HTTPException(status_code=409, detail=str(ex))
+            file_name = f"profile-{os.getenv('POD_NAME', socket.gethostname())}-{int(time.time())}.zip"
+            return Response(content=archive, media_type="application/zip",
+                            headers={"Content-Disposition": f"attachment; filename={file_name}"})
 
         @self.app.get("/uploadInputFile")
         def upload_new_datafile():
             return self.upload_new_datafile()
 
-    # Log new data to S3
-    @staticmethod
-    def create_new_input_file(feedback):
+    # Capture new data for retraining, written to disk by the background writer.
+    # Records dropped under backpressure are counted in the capture stats.
+    def create_new_input_file(self, feedback):
         new_data = {
             "text": feedback.text,
             "stars": feedback.stars
         }
-        feedback_queue.put(json.dumps(new_data) + "\n")
-
-    def write_to_file(self):
-        self.logger.info(f"Write feedback requests if queue is not empty- {feedback_queue.empty()}")
-        try:
-            if not feedback_queue.empty():
-                with open(self.new_data_file_local, "a") as f:
-                    while not feedback_queue.empty():
-                        f.write(feedback_queue.get())
-        except Exception as ex:
-            self.logger.error(f"write failed. {ex}", exc_info=True)
+        with metrics.ENQUEUE_LATENCY.time():
+            if not self.feedback_writer.put(new_data):
+                metrics.CAPTURE_DROPPED_TOTAL.inc()
 
     # Calculate accuracy
     @staticmethod
@@ -78,88 +214,316 @@ class FeedbackAnalysis:
         else:
             return 1.0
 
-    def analyze_feedback(self,feedback):
+    # The model serving new requests; take it once per request
+    @property
+    def serving(self):
+        return self.model_reloader.current
+
+    def build_serving(self, model, tokenizer, version, model_dir):
+        return ServingModel(model, tokenizer, version, model_dir, self.device, self.logger)
+
+    def model_info(self):
+        serving = self.serving
+        previous = self.model_reloader.previous
+        return {
+            "version": serving.version,
+            "previous_version": previous.version if previous else None,
+            "backend": serving.backend.name,
+            "timings": serving.timings,
+            "pid": os.getpid()
+        }
+
+    # Scheduled items carry the model they were encoded for, so a batch straddling a swap
+    # runs each request on its own model.
+    def predict_scheduled(self, items):
+        results = [None] * len(items)
+        groups = {}
+        for idx, (serving, _) in enumerate(items):
+            groups.setdefault(id(serving), (serving, []))[1].append(idx)
+        metrics.BATCH_SIZE.observe(len(items))
+        for serving, indices in groups.values():
+            with metrics.FORWARD_LATENCY.time():
+                predictions = serving.predict_batch([items[idx][1] for idx in indices])
+            for idx, prediction in zip(indices, predictions):
+                results[idx] = prediction
+        return results
+
+    # Admin endpoints are hidden unless ADMIN_TOKEN is configured
+    @staticmethod
+    def require_admin(x_admin_token):
+        if not ADMIN_TOKEN:
+            raise HTTPException(status_code=404, detail="Not Found")
+        if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    @staticmethod
+    def shed_request(reason):
+        metrics.SHED_TOTAL.labels(reason=reason).inc()
+        if reason == "queue_full":
+            raise HTTPException(status_code=429, detail="Inference queue is full, retry later.",
+                                headers={"Retry-After": RETRY_AFTER_SECONDS})
+        raise HTTPException(status_code=503, detail="Request deadline passed before inference.",
+                            headers={"Retry-After": RETRY_AFTER_SECONDS})
+
+    # Reject out-of-range stars and pre-tokenized inputs that do not fit the model
+    @staticmethod
+    def validate_feedback(feedback, serving):
+        if feedback.stars < 1 or feedback.stars > 5:
+            raise ValueError("Stars must be between 1 and 5")
+        if feedback.input_ids is not None:
+            serving.validate_input_ids(feedback.input_ids)
+
+    # Combine the predicted class with the star rating
+    @staticmethod
+    def score_feedback(predictions, stars):
+        sentiment = sentiment_labels[predictions]
+
+        # Feedback scoring based on stars
+        stars_weight = stars / 5
+        feedback_score = predictions + stars_weight
+
+        # Accuracy
+        accuracy = FeedbackAnalysis.calculate_accuracy(feedback_score)
+
+        # Interpret overall sentiment
+        if feedback_score <= 1:
+            overall_sentiment = "Angry"
+        elif feedback_score <= 2:
+            overall_sentiment = "Disappointed"
+        elif feedback_score <= 3:
+            overall_sentiment = "Neutral"
+        elif feedback_score <= 4:
+            overall_sentiment = "Satisfied"
+        else:
+            overall_sentiment = "Happy"
+
+        return sentiment, feedback_score, overall_sentiment, accuracy
+
+    # First-stage prediction for a cache miss, or None when the model has to decide
+    def cascade_predict(self, feedback):
+        if self.cascade is None:
+            return None
+        predictions = self.cascade.predict(feedback.text, feedback.stars)
+        metrics.CASCADE_ROUTES_TOTAL.labels(stage=self.cascade.name if predictions is not None else "model").inc()
+        return predictions
+
+    def analyze_feedback(self, feedback, serving, deadline=None):
         self.logger.info("Starting inference for new feedback.")
         try:
-            tokens = self.tokenizer.tokenize(feedback.text.lower())
-            input_ids = self.tokenizer.convert_tokens_to_ids(tokens)
-            inputs = torch.tensor([input_ids]).to(self.device)
-
-            # Predict sentiment
-            with torch.no_grad():
-                outputs = self.model(inputs)
-                predictions = torch.argmax(outputs.logits, dim=1).item()
-                sentiment = sentiment_labels[predictions]
-
-            # Feedback scoring based on stars
-            stars_weight = feedback.stars / 5
-            feedback_score = predictions + stars_weight
-
-            # Accuracy
-            accuracy = FeedbackAnalysis.calculate_accuracy(feedback_score)
-
-            # Interpret overall sentiment
-            if feedback_score <= 1:
-                overall_sentiment = "Angry"
-            elif feedback_score <= 2:
-                overall_sentiment = "Disappointed"
-            elif feedback_score <= 3:
-                overall_sentiment = "Neutral"
-            elif feedback_score <= 4:
-                overall_sentiment = "Satisfied"
+            # Predict sentiment from the cache, then the cascade's first stage, otherwise batched
+            # with concurrent requests. Pre-tokenized requests bypass both.
+            stage = "model"
+            if feedback.input_ids is not None:
+                predictions, batch_size, queue_wait_ms = self.scheduler.submit((serving, feedback.input_ids), deadline)
             else:
-                overall_sentiment = "Happy"
+                predictions = self.cache.get(feedback.text, serving.version)
+                if predictions is not None:
+                    stage = "cache"
+                else:
+                    predictions = self.cascade_predict(feedback)
+                    if predictions is not None:
+                        stage = self.cascade.name
+                if predictions is not None:
+                    batch_size, queue_wait_ms = 0, 0.0
+                else:
+                    with metrics.TOKENIZATION_LATENCY.time():
+                        input_ids = serving.encode_text(feedback.text)
+                    predictions, batch_size, queue_wait_ms = self.scheduler.submit((serving, input_ids), deadline)
+                    self.cache.put(feedback.text, serving.version, predictions)
+            if batch_size:
+                metrics.QUEUE_WAIT.observe(queue_wait_ms / 1000)
+            with metrics.POSTPROCESSING_LATENCY.time():
+                sentiment, feedback_score, overall_sentiment, accuracy = FeedbackAnalysis.score_feedback(
+                    predictions, feedback.stars)
+            metrics.SENTIMENT_TOTAL.labels(sentiment=sentiment, overall_sentiment=overall_sentiment).inc()
 
-            return sentiment, feedback_score, overall_sentiment, accuracy
+            return sentiment, feedback_score, overall_sentiment, accuracy, batch_size, queue_wait_ms, stage
 
+        except (QueueFullError, DeadlineExceededError):
+            raise
         except Exception as e:
             self.logger.error("Error during inference.", exc_info=True)
             raise e
 
-    def analyze(self, feedback):
+    # Score one chunk of bulk items, sorted into length buckets to keep padding low.
+    # Returns one JSON line per item in the original order.
+    def analyze_bulk_chunk(self, items):
+        pod_name = os.getenv("POD_NAME", "unknown_pod")
+        serving = self.serving
+        lines = [None] * len(items)
+        encoded = []
+        to_encode = []
+        for idx, item in enumerate(items):
+            try:
+                feedback = FeedbackRequest(**(json.loads(item) if isinstance(item, bytes) else item))
+                FeedbackAnalysis.validate_feedback(feedback, serving)
+            except Exception as ex:
+                metrics.ERRORS_TOTAL.labels(kind="bulk_item").inc()
+                lines[idx] = json.dumps({"error": str(ex)}) + "\n"
+                continue
+            self.create_new_input_file(feedback)
+            if feedback.input_ids is not None:
+                encoded.append((idx, feedback, feedback.input_ids))
+                continue
+            cached = self.cache.get(feedback.text, serving.version)
+            if cached is not None:
+                lines[idx] = self.bulk_response_line(feedback, cached, 0.0, pod_name, serving.version, "cache")
+                continue
+            cascaded = self.cascade_predict(feedback)
+            if cascaded is not None:
+                lines[idx] = self.bulk_response_line(feedback, cascaded, 0.0, pod_name, serving.version,
+                                                     self.cascade.name)
+                continue
+            to_encode.append((idx, feedback))
+        if to_encode:
+            with metrics.TOKENIZATION_LATENCY.time():
+                batch_input_ids = serving.encode_texts([feedback.text for _, feedback in to_encode])
+            encoded.extend((idx, feedback, input_ids) for (idx, feedback), input_ids in zip(to_encode, batch_input_ids))
+
+        # Buckets go through the scheduler at bulk priority, so a backfill only ever delays
+        # interactive requests by the one bucket being forwarded
+        encoded.sort(key=lambda entry: len(entry[2]))
+        for start in range(0, len(encoded), BULK_BATCH_SIZE):
+            bucket = encoded[start:start + BULK_BATCH_SIZE]
+            bucket_start = time.perf_counter()
+            predictions, _, _ = self.scheduler.submit_bulk([(serving, input_ids) for _, _, input_ids in bucket])
+            execution_time = (time.perf_counter() - bucket_start) * 1000 / len(bucket)
+            for (idx, feedback, _), prediction in zip(bucket, predictions):
+                if feedback.input_ids is None:
+                    self.cache.put(feedback.text, serving.version, prediction)
+                lines[idx] = self.bulk_response_line(feedback, prediction, execution_time, pod_name, serving.version,
+                                                     "model")
+        return lines
+
+    @staticmethod
+    def bulk_response_line(feedback, predictions, execution_time, pod_name, model_version, answered_by):
+        sentiment, feedback_score, overall_sentiment, accuracy = FeedbackAnalysis.score_feedback(
+            predictions, feedback.stars)
+        metrics.SENTIMENT_TOTAL.labels(sentiment=sentiment, overall_sentiment=overall_sentiment).inc()
+        response = FeedbackResponse(
+            sentiment=overall_sentiment,
+            feedback_score=round(feedback_score, 2),
+            accuracy=round(accuracy, 2),
+            inference_time=round(execution_time, 2),
+            pod_name=pod_name,
+            model_version=model_version,
+            answered_by=answered_by
+        )
+        return json.dumps(jsonable_encoder(response)) + "\n"
+
+    async def analyze_bulk(self, request):
+        chunk = []
+        total = 0
+        async for item in read_bulk_items(request):
+            chunk.append(item)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                for line in await to_thread.run_sync(self.analyze_bulk_chunk, chunk, limiter=self.bulk_limiter):
+                    yield line
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            for line in await to_thread.run_sync(self.analyze_bulk_chunk, chunk, limiter=self.bulk_limiter):
+                yield line
+            total += len(chunk)
+        self.logger.info(f"Bulk analysis finished for {total} feedback items.")
+
+    def analyze(self, feedback, response=None, deadline=None):
         start = time.perf_counter()
-        if feedback.stars < 1 or feedback.stars > 5:
-            raise HTTPException(status_code=400, detail="Stars must be between 1 and 5")
+        # The request may have waited for a worker thread past its deadline
+        if deadline is not None and start >= deadline:
+            self.shed_request("deadline")
+        serving = self.serving
+        try:
+            with metrics.VALIDATION_LATENCY.time():
+                FeedbackAnalysis.validate_feedback(feedback, serving)
+        except ValueError as ex:
+            metrics.ERRORS_TOTAL.labels(kind="validation").inc()
+            raise HTTPException(status_code=400, detail=str(ex))
 
-        FeedbackAnalysis.create_new_input_file(feedback)
+        self.create_new_input_file(feedback)
         pod_name = os.getenv("POD_NAME", "unknown_pod")
+        profiling = self.profiler.active
+        if profiling:
+            traced_before = Profiler.traced_memory()
 
         # Perform inference and send response
         try:
-            sentiment, feedback_score, overall_sentiment, accuracy = self.analyze_feedback(
-                feedback)
+            sentiment, feedback_score, overall_sentiment, accuracy, batch_size, queue_wait_ms, stage = self.analyze_feedback(
+                feedback, serving, deadline)
             end = time.perf_counter()
             execution_time = (end - start) * 1000
+            metrics.REQUEST_LATENCY.observe(end - start)
+            if profiling:
+                self.profiler.record_request(traced_before)
             self.logger.info(f"Final Analysis: " +
                         f"Sentiment: {sentiment} " +
                         f"Overall sentiment: {overall_sentiment} " +
                         f"Feedback score: {round(feedback_score, 2)} " +
                         f"Accuracy: {round(accuracy, 2)} " +
-                        f"Inference time: {round(execution_time, 2)} ")
+                        f"Inference time: {round(execution_time, 2)} " +
+                        f"Batch size: {batch_size} " +
+                        f"Queue wait: {round(queue_wait_ms, 2)} " +
+                        f"Answered by: {stage} " +
+                        f"Model version: {serving.version} ")
+            if response is not None:
+                response.headers["X-Batch-Size"] = str(batch_size)
+                response.headers["X-Queue-Wait-Ms"] = str(round(queue_wait_ms, 2))
+                response.headers["X-Model-Version"] = serving.version
+                response.headers["X-Cascade-Stage"] = stage
             return FeedbackResponse(
                 sentiment=overall_sentiment,
                 feedback_score=round(feedback_score, 2),
                 accuracy=round(accuracy, 2),
                 inference_time=round(execution_time, 2),
-                pod_name=pod_name
+                pod_name=pod_name,
+                model_version=serving.version,
+                answered_by=stage
             )
+        except QueueFullError:
+            self.shed_request("queue_full")
+        except DeadlineExceededError:
+            self.shed_request("deadline")
         except Exception:
+            metrics.ERRORS_TOTAL.labels(kind="inference").inc()
             self.logger.error("Failed to process feedback.", exc_info=True)
             raise HTTPException(status_code=500, detail="An error occurred during inference.")
 
+    # Schedule an upload of the segments captured since the last successful one
     def upload_new_datafile(self):
-        # Upload to S3
+        self.segment_uploader.request_upload()
+        self.logger.info("New feedback data upload to S3 scheduled.")
+        return {"status": "scheduled", **self.segment_uploader.stats()}
+
+# Yield bulk items from either a JSON array body or a streamed JSONL body
+async def read_bulk_items(request: Request):
+    buffer = b""
+    is_array = None
+    async for data in request.stream():
+        buffer += data
+        if is_array is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            is_array = stripped.startswith(b"[")
+        if not is_array:
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+    if is_array:
         try:
-            self.write_to_file()
-            self.s3_client.upload_file(self.new_data_file_local, self.S3_BUCKET, f"{self.NEW_DATA_PATH}inputFile.jsonl")
-            self.logger.info("New feedback data uploaded to S3.")
-        except Exception:
-            self.logger.error("Failed to upload new feedback data to S3.", exc_info=True)
-            raise HTTPException(status_code=500, detail="Failed to upload file.")
+            items = json.loads(buffer)
+        except ValueError:
+            # Surfaces as a single error line in the response
+            items = [buffer]
+        for item in items:
+            yield item
+    elif buffer.strip():
+        yield buffer
 
 def setting_jaeger(app: FastAPI, log_correlation: bool = True) -> None:
     # set the tracer provider
-    tracer = TracerProvider()
+    tracer = TracerProvider(sampler=ParentBased(TraceIdRatioBased(OTEL_TRACES_SAMPLER_RATIO)))
     trace.set_tracer_provider(tracer)
     if MODE == "otlp-http":
         tracer.add_span_processor(
@@ -167,4 +531,5 @@ def setting_jaeger(app: FastAPI, log_correlation: bool = True) -> None:
         )
     if log_correlation:
         LoggingInstrumentor().instrument(set_logging_format=True)
-    FastAPIInstrumentor.instrument_app(app, tracer_provider=tracer)
\ No newline at end of file
+    # Prometheus scrapes would otherwise produce a span every few seconds
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=tracer, excluded_urls="metrics,admin/profile")
\ No newline at end of file
@@ -1,5 +1,8 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 class FeedbackRequest(BaseModel):
     text: str
-    stars: int
\ No newline at end of file
+    stars: int
+    # Optional token ids (with special tokens) from callers that tokenize upstream
+    input_ids: Optional[List[int]] = None
\ No newline at end of file
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class FeedbackResponse(BaseModel):
@@ -5,4 +6,7 @@ class FeedbackResponse(BaseModel):
     feedback_score: float
     accuracy: float
     inference_time: float
-    pod_name: str
\ No newline at end of file
+    pod_name: str
+    model_version: Optional[str] = None
+    # model, cache or the cascade stage that answered
+    answered_by: Optional[str] = None
\ No newline at end of file
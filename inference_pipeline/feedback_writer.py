@@ -0,0 +1,170 @@
+import fcntl
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+
+# Captured feedback is buffered in a bounded queue; records are dropped rather than blocking requests
+CAPTURE_QUEUE_SIZE = int(os.environ.get("CAPTURE_QUEUE_SIZE", "10000"))
+CAPTURE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("CAPTURE_FLUSH_INTERVAL_SECONDS", "2"))
+CAPTURE_FLUSH_BATCH_SIZE = int(os.environ.get("CAPTURE_FLUSH_BATCH_SIZE", "500"))
+# A segment is sealed (closed, fsynced and renamed) once it reaches either limit
+SEGMENT_MAX_RECORDS = int(os.environ.get("SEGMENT_MAX_RECORDS", "50000"))
+SEGMENT_MAX_AGE_SECONDS = float(os.environ.get("SEGMENT_MAX_AGE_SECONDS", "600"))
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+OPEN_SUFFIX = ".open"
+
+
+def sealed_segments(segment_dir):
+    return sorted(glob.glob(os.path.join(segment_dir, f"*{SEGMENT_SUFFIX}")))
+
+
+# Background writer draining captured feedback into rotating, gzip-compressed JSONL segments
+class FeedbackWriter:
+    def __init__(self, segment_dir, logger, pod_name):
+        self.segment_dir = segment_dir
+        self.logger = logger
+        self.pod_name = pod_name
+        self.queue = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        # Guards the open segment between the writer thread and seal()
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sealed = 0
+        self.sequence = 0
+        self.raw_file = None
+        self.gzip_file = None
+        self.segment_path = None
+        self.segment_records = 0
+        self.segment_opened_at = 0.0
+        self.worker = None
+        os.makedirs(segment_dir, exist_ok=True)
+
+    def start(self):
+        self.recover_open_segments()
+        self.worker = threading.Thread(target=self.run, name="feedback-writer", daemon=True)
+        self.worker.start()
+
+    # Hot path: never blocks and never touches the disk
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped += 1
+            return False
+        with self.stats_lock:
+            self.enqueued += 1
+        return True
+
+    # Segments left open by a dead process hold all records up to their last flush. Live
+    # writers (other workers in the pod) keep an exclusive lock on their open segment.
+    def recover_open_segments(self):
+        for path in glob.glob(os.path.join(self.segment_dir, f"*{SEGMENT_SUFFIX}{OPEN_SUFFIX}")):
+            # Never create the file: a segment sealed since the glob must not be replaced by an empty one
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            with os.fdopen(fd, "rb+") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                # Its writer sealed it between the open and the lock
+                if not os.path.exists(path):
+                    continue
+                os.replace(path, path[:-len(OPEN_SUFFIX)])
+            self.logger.warning(f"Recovered unsealed feedback segment {path}")
+
+    # Wait up to the flush interval or until a full batch is available
+    def drain(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < CAPTURE_FLUSH_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.drain(CAPTURE_FLUSH_INTERVAL_SECONDS)
+            try:
+                with self.lock:
+                    if batch:
+                        self.write_batch(batch)
+                    if self.segment_path is not None and (
+                            self.segment_records >= SEGMENT_MAX_RECORDS or
+                            time.monotonic() - self.segment_opened_at >= SEGMENT_MAX_AGE_SECONDS):
+                        self.seal_segment()
+            except Exception:
+                self.logger.error(f"Failed to write {len(batch)} feedback records.", exc_info=True)
+
+    def open_segment(self):
+        self.sequence += 1
+        timestamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        name = f"feedback-{self.pod_name}-{os.getpid()}-{timestamp}-{self.sequence:06d}{SEGMENT_SUFFIX}"
+        self.segment_path = os.path.join(self.segment_dir, name)
+        self.raw_file = open(f"{self.segment_path}{OPEN_SUFFIX}", "ab")
+        fcntl.flock(self.raw_file, fcntl.LOCK_EX)
+        self.gzip_file = gzip.GzipFile(fileobj=self.raw_file, mode="ab")
+        self.segment_records = 0
+        self.segment_opened_at = time.monotonic()
+
+    def write_batch(self, batch):
+        if self.segment_path is None:
+            self.open_segment()
+        self.gzip_file.write("".join(json.dumps(record) + "\n" for record in batch).encode("utf-8"))
+        # Sync flush keeps everything written so far readable if the process dies
+        self.gzip_file.flush()
+        self.segment_records += len(batch)
+        with self.stats_lock:
+            self.written += len(batch)
+
+    def seal_segment(self):
+        self.gzip_file.close()
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        # Rename while still holding the lock so recovery never races the seal
+        os.replace(f"{self.segment_path}{OPEN_SUFFIX}", self.segment_path)
+        self.raw_file.close()
+        self.logger.info(f"Sealed feedback segment {self.segment_path} with {self.segment_records} records.")
+        self.sealed += 1
+        self.gzip_file = None
+        self.raw_file = None
+        self.segment_path = None
+
+    # Write out everything queued so far and seal the open segment
+    def seal(self):
+        with self.lock:
+            batch = self.drain(0)
+            while batch:
+                self.write_batch(batch)
+                batch = self.drain(0)
+            if self.segment_path is not None:
+                self.seal_segment()
+        return sealed_segments(self.segment_dir)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": CAPTURE_QUEUE_SIZE,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "sealed_segments": self.sealed,
+                "open_segment_records": self.segment_records if self.segment_path else 0
+            }
@@ -0,0 +1,105 @@
+# Multi-worker serving mode: gunicorn -c gunicorn_conf.py inference:app
+# The app (and the model) is loaded once in the master and workers are forked from it, so the
+# weights are shared copy-on-write. The pod's CPU quota is split between the workers' torch
+# thread pools instead of every worker using all cores. New model versions are loaded by the
+# master too, which then recycles the workers onto them.
+import gc
+import os
+import shutil
+import signal
+import time
+
+
+def cgroup_cpu_limit():
+    # cgroup v2
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    # cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+cpu_limit = max(1, int(cgroup_cpu_limit()))
+workers = int(os.environ.get("WEB_CONCURRENCY", cpu_limit))
+intra_op_threads = int(os.environ.get("TORCH_INTRA_OP_THREADS", max(1, cpu_limit // workers)))
+inter_op_threads = int(os.environ.get("TORCH_INTER_OP_THREADS", "1"))
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+
+# The master only loads and warms up the model; keeping its OpenMP pool single-threaded
+# avoids forking with live intra-op threads, which can deadlock the workers.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+# New model versions are loaded once in the master instead of in every worker
+os.environ.setdefault("MODEL_RELOAD_MODE", "master")
+
+# Workers write their Prometheus samples here so /metrics aggregates the whole pod. Must be set
+# before the app is imported, and emptied so samples from a previous run are not reported.
+prometheus_multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # Move everything allocated while loading out of the collector's reach, so garbage
+    # collection in the workers doesn't touch (and un-share) those pages
+    gc.freeze()
+    server.log.info(f"CPU limit {cpu_limit}: {workers} workers x {intra_op_threads} intra-op threads")
+    # Loaded by preload_app
+    import inference
+    import model_reloader
+
+    # With MODEL_RELOAD_MODE=worker set explicitly, every worker polls and swaps on its own instead
+    if model_reloader.MODEL_RELOAD_MODE == "master":
+        inference.feedback_analysis.model_reloader.start_in_master(lambda: recycle_workers(server))
+
+
+# Called from the master's reloader after it swapped models: replace the workers one at a time
+# so every replacement forks from (and shares) the new model while the others keep serving
+def recycle_workers(server):
+    gc.freeze()
+    for pid in list(server.WORKERS):
+        server.log.info(f"Recycling worker {pid} onto the new model version")
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            continue
+        deadline = time.monotonic() + server.cfg.graceful_timeout + 30
+        while time.monotonic() < deadline and (pid in server.WORKERS or len(server.WORKERS) < server.num_workers):
+            time.sleep(0.5)
+
+
+def post_fork(server, worker):
+    import torch
+
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # Already fixed by the master
+        pass
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drop the live gauges of the dead worker
+    multiprocess.mark_process_dead(worker.pid)
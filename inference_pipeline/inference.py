@@ -1,9 +1,10 @@
 from fastapi import FastAPI
-from transformers import MobileBertTokenizer, MobileBertForSequenceClassification
 import boto3
 import os
 import logging
 from feedback_analysis import FeedbackAnalysis
+from local_s3 import LocalS3Client
+from model_store import ModelStore
 
 
 # Configure logging
@@ -18,48 +19,43 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 # AWS S3 Configuration
 S3_BUCKET = "customerfeedbackmlbucket"
-MODEL_PATH = "models/"
+# models/ serves the MobileBERT model, models/student/ the distilled student (e.g. on edge pods)
+MODEL_PATH = os.environ.get("MODEL_PATH", "models/")
 NEW_DATA_PATH = "datasets/"
 local_model_dir = os.path.expanduser("~/s3/inference/models/")
 new_data_path_local = os.path.expanduser("~/s3/inference/datasets/")
-new_data_file_local = os.path.join(new_data_path_local, "inputFile.jsonl")
-s3_client = boto3.client('s3', region_name='eu-central-1')
+segment_dir_local = os.path.join(new_data_path_local, "segments")
+# S3_LOCAL_ROOT swaps in a filesystem-backed client, S3_ENDPOINT_URL points at a stand-in such as moto
+S3_LOCAL_ROOT = os.environ.get("S3_LOCAL_ROOT")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+if S3_LOCAL_ROOT:
+    s3_client = LocalS3Client(S3_LOCAL_ROOT)
+else:
+    s3_client = boto3.client('s3', region_name='eu-central-1', endpoint_url=S3_ENDPOINT_URL)
 
 app = FastAPI()
 os.makedirs(new_data_path_local, exist_ok=True)
 
-# Load the model and tokenizer from S3
+model_store = ModelStore(s3_client, S3_BUCKET, logger, model_path=MODEL_PATH, local_root=local_model_dir)
+
+# Load the latest published model and tokenizer from S3, reusing unchanged files from the local cache
 def download_model_from_s3():
-    os.makedirs(local_model_dir, exist_ok=True)
-    logger.info("Downloading model files from S3...")
+    logger.info("Syncing model files from S3...")
     try:
-        # List all files in the specified S3 bucket directory
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=MODEL_PATH)
-        if 'Contents' not in response:
-            raise ValueError(f"No files found in S3 path: {MODEL_PATH}")
-
-        for obj in response['Contents']:
-            file_name = os.path.basename(obj['Key'])
-            if file_name:
-                local_file_path = os.path.join(f"{local_model_dir}", f"{file_name}")
-                try:
-                    s3_client.download_file(S3_BUCKET, obj['Key'], local_file_path)
-                    logger.info(f"Successfully downloaded {file_name} from S3.")
-                except Exception as e1:
-                    logger.error(f"Error downloading {file_name} from S3: {e1}")
-                    raise e1
+        model_version, model_dir, startup_timings = model_store.fetch()
     except Exception as e2:
-        logger.error(f"Error listing files from S3: {e2}")
+        logger.error(f"Error syncing model files from S3: {e2}")
         raise e2
-    mb_model = MobileBertForSequenceClassification.from_pretrained(f"{local_model_dir}")
-    mb_tokenizer = MobileBertTokenizer.from_pretrained(f"{local_model_dir}")
-    return mb_model, mb_tokenizer
+    mb_model, mb_tokenizer, startup_timings["load_ms"] = model_store.load(model_dir)
+    return mb_model, mb_tokenizer, model_version, model_dir, startup_timings
 
 try:
-    model, tokenizer = download_model_from_s3()
+    model, tokenizer, model_version, model_dir, startup_timings = download_model_from_s3()
     device = "cpu"
     model = model.to(device)
-    feedback_analysis = FeedbackAnalysis(app=app, new_data_file_local=new_data_file_local, logger=logger, model=model, tokenizer=tokenizer, s3_client=s3_client, s3_bucket=S3_BUCKET, new_data_path=NEW_DATA_PATH, device=device)
+    feedback_analysis = FeedbackAnalysis(app=app, segment_dir=segment_dir_local, logger=logger, model=model, tokenizer=tokenizer, s3_client=s3_client, s3_bucket=S3_BUCKET, new_data_path=NEW_DATA_PATH, device=device, model_version=model_version, model_dir=model_dir, startup_timings=startup_timings, model_store=model_store)
+    # The serving backend owns the weights from here on
+    del model
 except Exception as e:
     logger.critical("Failed to load model. Service cannot start.", exc_info=True)
     raise RuntimeError("Model initialization failed.")
\ No newline at end of file
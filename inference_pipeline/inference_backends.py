@@ -0,0 +1,174 @@
+import json
+import os
+import torch
+
+# Inference engine: fp32 (eager), int8 (torch dynamic quantization) or onnx (onnxruntime)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "fp32")
+# A non-fp32 backend is served only if it predicts the same label as fp32 on at least
+# PARITY_MIN_AGREEMENT of a sample of at least PARITY_MIN_SAMPLES texts: with the defaults,
+# at most 25 disagreements out of 500
+PARITY_MIN_AGREEMENT = float(os.environ.get("PARITY_MIN_AGREEMENT", "0.95"))
+PARITY_MIN_SAMPLES = int(os.environ.get("PARITY_MIN_SAMPLES", "200"))
+# JSON list of {"text": ...} records; the default ships with the image (500 reviews, 100 per
+# star rating, drawn from file_processing/inputFile2.json and inputFile3.json)
+PARITY_SAMPLE_FILE = os.environ.get("PARITY_SAMPLE_FILE",
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "parity_sample.json"))
+PARITY_SAMPLE_SIZE = int(os.environ.get("PARITY_SAMPLE_SIZE", "500"))
+PARITY_BATCH_SIZE = 16
+
+# Short reviews run through the model before it serves traffic
+WARMUP_TEXTS = [
+    "This product is a scam, don't waste your money. I feel completely cheated.",
+    "Terrible quality, it broke after two days and support never answered.",
+    "Not what I expected. The material feels cheap and the size is wrong.",
+    "It is okay, does what it says but nothing more.",
+    "The experience was neutral, nothing special about it.",
+    "Delivery was on time and the product works as described.",
+    "Pretty good value for the price, I would buy it again.",
+    "This is one of the best purchases I've ever made! Absolutely love it.",
+    "Fantastic quality and the customer service was incredibly helpful.",
+    "I am disappointed, the colour faded after the first wash.",
+    "Works fine most of the time, occasionally a bit slow.",
+    "Awful. Arrived damaged and the replacement was damaged too.",
+    "Great product, my whole family uses it every day.",
+    "Average at best, there are better options on the market.",
+    "Exceeded my expectations in every way, highly recommended!",
+    "The instructions were confusing but it works after setup.",
+]
+
+
+# Right-pad token id lists into input_ids / attention_mask tensors
+def pad_batch(batch_input_ids, pad_id):
+    max_len = max(len(input_ids) for input_ids in batch_input_ids)
+    input_ids = torch.full((len(batch_input_ids), max_len), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_input_ids), max_len), dtype=torch.long)
+    for row, ids in enumerate(batch_input_ids):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+class EagerBackend:
+    name = "fp32"
+
+    def __init__(self, model, device):
+        self.model = model.eval()
+        self.device = device
+
+    def logits(self, input_ids, attention_mask):
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device))
+            return outputs.logits.cpu()
+
+    # Bytes held by weights and buffers; dynamic-quantized layers store packed (weight, bias) tuples
+    def memory_bytes(self):
+        total = 0
+        for value in self.model.state_dict().values():
+            tensors = value if isinstance(value, tuple) else (value,)
+            total += sum(tensor.numel() * tensor.element_size() for tensor in tensors if isinstance(tensor, torch.Tensor))
+        return total
+
+
+class QuantizedBackend(EagerBackend):
+    name = "int8"
+
+    def __init__(self, model):
+        quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(quantized, "cpu")
+
+
+class LogitsOnly(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model, model_dir, model_version, logger):
+        # Fail before exporting when onnxruntime is not installed
+        import onnxruntime  # noqa: F401
+
+        onnx_path = os.path.join(model_dir, f"model-{model_version}.onnx")
+        if not os.path.exists(onnx_path):
+            logger.info(f"Exporting ONNX graph to {onnx_path}")
+            OnnxBackend.export(model, onnx_path)
+        self.onnx_path = onnx_path
+        self.session = None
+        self.session_pid = None
+
+    # onnxruntime thread pools do not survive a fork, so each process opens its own session
+    def get_session(self):
+        if self.session is None or self.session_pid != os.getpid():
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = torch.get_num_threads()
+            self.session = onnxruntime.InferenceSession(self.onnx_path, options, providers=["CPUExecutionProvider"])
+            self.session_pid = os.getpid()
+        return self.session
+
+    @staticmethod
+    def export(model, onnx_path):
+        dummy = torch.ones((1, 8), dtype=torch.long)
+        tmp_path = f"{onnx_path}.tmp-{os.getpid()}"
+        torch.onnx.export(
+            LogitsOnly(model.eval().to("cpu")),
+            (dummy, dummy),
+            tmp_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"}
+            },
+            opset_version=14
+        )
+        os.replace(tmp_path, onnx_path)
+
+    def memory_bytes(self):
+        return os.path.getsize(self.onnx_path)
+
+    def logits(self, input_ids, attention_mask):
+        outputs = self.get_session().run(["logits"], {
+            "input_ids": input_ids.numpy(),
+            "attention_mask": attention_mask.numpy()
+        })
+        return torch.from_numpy(outputs[0])
+
+
+def create_backend(name, model, device, model_dir, model_version, logger):
+    if name == "fp32":
+        return EagerBackend(model, device)
+    if name == "int8":
+        return QuantizedBackend(model)
+    if name == "onnx":
+        return OnnxBackend(model, model_dir, model_version, logger)
+    raise ValueError(f"Unknown inference backend: {name}")
+
+
+def parity_sample_texts():
+    with open(PARITY_SAMPLE_FILE, "r") as f:
+        records = json.load(f)
+    texts = [record["text"] for record in records[:PARITY_SAMPLE_SIZE]]
+    if len(texts) < PARITY_MIN_SAMPLES:
+        raise ValueError(f"Parity sample {PARITY_SAMPLE_FILE} has {len(texts)} texts, "
+                         f"at least {PARITY_MIN_SAMPLES} are required.")
+    return texts
+
+
+# Fraction of sample texts on which the candidate backend predicts the same label as the reference
+def label_agreement(candidate, reference, batch_input_ids, pad_id):
+    agree = 0
+    for start in range(0, len(batch_input_ids), PARITY_BATCH_SIZE):
+        input_ids, attention_mask = pad_batch(batch_input_ids[start:start + PARITY_BATCH_SIZE], pad_id)
+        candidate_labels = torch.argmax(candidate.logits(input_ids, attention_mask), dim=1)
+        reference_labels = torch.argmax(reference.logits(input_ids, attention_mask), dim=1)
+        agree += int((candidate_labels == reference_labels).sum())
+    return agree / max(len(batch_input_ids), 1)
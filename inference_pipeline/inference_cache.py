@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+# Cache bounds, a size of 0 disables the cache
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "3600"))
+
+
+# LRU/TTL cache of predicted classes keyed on the model version and the normalized review text.
+# Requests still running on a swapped-out model neither see nor evict the new model's entries;
+# entries of old versions age out of the LRU.
+class InferenceCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    # Tokenization is case- and whitespace-insensitive, so both are normalized away
+    @staticmethod
+    def cache_key(text, model_version):
+        normalized = " ".join(text.split()).lower()
+        return model_version, hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, text, model_version):
+        if not self.enabled:
+            return None
+        key = InferenceCache.cache_key(text, model_version)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.CACHE_MISSES.inc()
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            metrics.CACHE_HITS.inc()
+            return entry[0]
+
+    def put(self, text, model_version, prediction):
+        if not self.enabled:
+            return
+        key = InferenceCache.cache_key(text, model_version)
+        with self.lock:
+            self.entries[key] = (prediction, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
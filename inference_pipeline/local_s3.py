@@ -0,0 +1,96 @@
+import datetime
+import hashlib
+import io
+import os
+import shutil
+from botocore.exceptions import ClientError
+
+
+# Filesystem-backed stand-in for the subset of the boto3 S3 client used by the services.
+# Objects live under <root>/<bucket>/<key>; select it with S3_LOCAL_ROOT.
+class LocalS3Client:
+    def __init__(self, root):
+        self.root = root
+
+    def object_path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    @staticmethod
+    def not_found(operation, key):
+        return ClientError({"Error": {"Code": "404", "Message": f"Not Found: {key}"}}, operation)
+
+    @staticmethod
+    def etag(path):
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(block)
+        return f'"{md5.hexdigest()}"'
+
+    def write_atomic(self, bucket, key, source):
+        path = self.object_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(source, f)
+        os.replace(tmp_path, path)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, "rb") as source:
+            self.write_atomic(Bucket, Key, source)
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        path = self.object_path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3Client.not_found("HeadObject", Key)
+        shutil.copyfile(path, Filename)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        self.write_atomic(Bucket, Key, io.BytesIO(Body) if isinstance(Body, bytes) else Body)
+        return {"ETag": LocalS3Client.etag(self.object_path(Bucket, Key))}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self.object_path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3Client.not_found("HeadObject", Key)
+        return {"ETag": LocalS3Client.etag(path), "ContentLength": os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self.object_path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3Client.not_found("GetObject", Key)
+        with open(path, "rb") as f:
+            body = f.read()
+        return {"Body": io.BytesIO(body), "ETag": LocalS3Client.etag(path), "ContentLength": len(body)}
+
+    # With a Delimiter, keys continuing past it below the prefix are rolled up into CommonPrefixes
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        common_prefixes = set()
+        for dir_path, _, file_names in os.walk(bucket_root):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                key = os.path.relpath(path, bucket_root).replace(os.sep, "/")
+                if not key.startswith(Prefix) or ".tmp-" in file_name:
+                    continue
+                rest = key[len(Prefix):]
+                if Delimiter and Delimiter in rest:
+                    common_prefixes.add(Prefix + rest[:rest.index(Delimiter) + len(Delimiter)])
+                else:
+                    contents.append({
+                        "Key": key,
+                        "Size": os.path.getsize(path),
+                        "ETag": LocalS3Client.etag(path),
+                        "LastModified": datetime.datetime.fromtimestamp(os.path.getmtime(path), datetime.timezone.utc)
+                    })
+        contents.sort(key=lambda obj: obj["Key"])
+        # Like S3, an empty listing has no Contents or CommonPrefixes entry
+        response = {"KeyCount": len(contents) + len(common_prefixes), "IsTruncated": False}
+        if contents:
+            response["Contents"] = contents
+        if common_prefixes:
+            response["CommonPrefixes"] = [{"Prefix": prefix} for prefix in sorted(common_prefixes)]
+        return response
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Set by gunicorn_conf.py in multi-worker mode so every worker's samples are aggregated
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# Seconds between samples of the process-state gauges
+GAUGE_SAMPLE_SECONDS = float(os.environ.get("GAUGE_SAMPLE_SECONDS", "1"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STAGE_LATENCY = Histogram("feedback_inference_stage_seconds", "Latency of each stage of a feedback analysis",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+VALIDATION_LATENCY = STAGE_LATENCY.labels(stage="validation")
+TOKENIZATION_LATENCY = STAGE_LATENCY.labels(stage="tokenization")
+FORWARD_LATENCY = STAGE_LATENCY.labels(stage="forward")
+POSTPROCESSING_LATENCY = STAGE_LATENCY.labels(stage="postprocessing")
+ENQUEUE_LATENCY = STAGE_LATENCY.labels(stage="enqueue")
+REQUEST_LATENCY = STAGE_LATENCY.labels(stage="total")
+QUEUE_WAIT = Histogram("feedback_inference_queue_wait_seconds", "Time a request waited for its batch to run",
+                       buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("feedback_inference_batch_size", "Requests per model forward pass",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+SENTIMENT_TOTAL = Counter("feedback_sentiment_total", "Analysed feedback by predicted class and overall sentiment",
+                          ["sentiment", "overall_sentiment"])
+ERRORS_TOTAL = Counter("feedback_errors_total", "Failed feedback analyses by kind", ["kind"])
+CACHE_LOOKUPS_TOTAL = Counter("feedback_cache_lookups_total", "Inference cache lookups by result", ["result"])
+CACHE_HITS = CACHE_LOOKUPS_TOTAL.labels(result="hit")
+CACHE_MISSES = CACHE_LOOKUPS_TOTAL.labels(result="miss")
+CASCADE_ROUTES_TOTAL = Counter("feedback_cascade_routes_total",
+                               "Cache misses answered by each cascade stage (first stage or model)", ["stage"])
+SHED_TOTAL = Counter("feedback_requests_shed_total", "Requests rejected before inference by reason", ["reason"])
+CAPTURE_DROPPED_TOTAL = Counter("feedback_capture_dropped_total", "Captured feedback records dropped under backpressure")
+
+CAPTURE_QUEUE_DEPTH = Gauge("feedback_capture_queue_depth", "Records waiting for the feedback writer",
+                            multiprocess_mode="livesum")
+SCHEDULER_QUEUE_DEPTH = Gauge("feedback_scheduler_queue_depth", "Requests waiting for a batch slot",
+                              multiprocess_mode="livesum")
+REQUESTS_IN_FLIGHT = Gauge("feedback_requests_in_flight", "Admitted feedback analyses not yet answered",
+                           multiprocess_mode="livesum")
+MODEL_MEMORY_BYTES = Gauge("feedback_model_memory_bytes", "Memory held by the serving model's weights",
+                           multiprocess_mode="liveall")
+PROCESS_RESIDENT_MEMORY_BYTES = Gauge("feedback_process_resident_memory_bytes", "Resident memory of the serving process",
+                                      multiprocess_mode="liveall")
+MODEL_INFO = Gauge("feedback_model_info", "Model version and backend currently served", ["version", "backend"],
+                   multiprocess_mode="liveall")
+
+
+def resident_memory_bytes():
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+# Zeroed rather than removed: in multiprocess mode removed samples stay in the worker's mmap file
+def record_serving_model(serving):
+    for version, backend in list(MODEL_INFO._metrics):
+        MODEL_INFO.labels(version=version, backend=backend).set(0)
+    MODEL_INFO.labels(version=serving.version, backend=serving.backend.name).set(1)
+    MODEL_MEMORY_BYTES.set(serving.backend.memory_bytes())
+
+
+# Samples gauges describing process state in a background thread of every serving process. In
+# multiprocess mode each worker's sample is only as fresh as its last update, so setting them
+# while serving a scrape would leave the other workers' values stale.
+class GaugeSampler:
+    # `samples` pairs each gauge with a callable returning its current value
+    def __init__(self, samples, logger, interval=GAUGE_SAMPLE_SECONDS):
+        self.samples = samples + [(PROCESS_RESIDENT_MEMORY_BYTES, resident_memory_bytes)]
+        self.logger = logger
+        self.interval = interval
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self.run, name="gauge-sampler", daemon=True)
+        self.worker.start()
+
+    def run(self):
+        while True:
+            for gauge, sample in self.samples:
+                try:
+                    gauge.set(sample())
+                except Exception:
+                    self.logger.debug(f"Failed to sample {gauge._name}.", exc_info=True)
+            time.sleep(self.interval)
+
+
+def render():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
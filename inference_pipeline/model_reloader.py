@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+import metrics
+
+# Seconds between checks for a newly published model version, 0 disables polling
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", "60"))
+# Where new versions are loaded. "worker": the serving process polls and swaps its own model
+# (single-process uvicorn). "master": set by gunicorn_conf.py; the master polls, swaps and then
+# recycles its workers, so they fork from the new model and keep sharing its memory.
+MODEL_RELOAD_MODE = os.environ.get("MODEL_RELOAD_MODE", "worker")
+# Written into the model store's local root by a worker asking the master to roll back
+ROLLBACK_REQUEST_NAME = ".rollback_requested"
+ROLLBACK_CHECK_SECONDS = 1.0
+
+
+# Polls the model store and swaps freshly loaded, warmed-up models in off the request path.
+# Readers take `current` once per request; the swap is a single attribute assignment, so
+# in-flight requests finish on the model they started with.
+class ModelReloader:
+    def __init__(self, model_store, build_serving, current, logger):
+        self.model_store = model_store
+        # Callable (model, tokenizer, version, model_dir) -> ServingModel, including warm-up
+        self.build_serving = build_serving
+        self.current = current
+        self.previous = None
+        self.logger = logger
+        # Versions that failed to load or were rolled back are not picked up again
+        self.skipped_versions = set()
+        self.lock = threading.Lock()
+        self.worker = None
+        # Set in the gunicorn master; its forked workers leave reloading to it
+        self.master_pid = None
+        if model_store is not None:
+            model_store.prune([current.model_dir])
+
+    def start(self):
+        if MODEL_RELOAD_MODE == "worker" and self.model_store is not None and MODEL_POLL_SECONDS > 0:
+            self.worker = threading.Thread(target=self.run, name="model-reloader", daemon=True)
+            self.worker.start()
+
+    # Called in the gunicorn master before the workers are forked; `recycle` replaces the workers
+    # once a new version (or a rollback) has been swapped in
+    def start_in_master(self, recycle):
+        self.master_pid = os.getpid()
+        if self.model_store is not None:
+            self.worker = threading.Thread(target=self.run_master, args=(recycle,), name="model-reloader",
+                                           daemon=True)
+            self.worker.start()
+
+    @property
+    def delegates_to_master(self):
+        return self.master_pid is not None and os.getpid() != self.master_pid
+
+    def run(self):
+        while True:
+            time.sleep(MODEL_POLL_SECONDS)
+            try:
+                self.check_for_update()
+            except Exception:
+                self.logger.error("Model update check failed.", exc_info=True)
+
+    def run_master(self, recycle):
+        next_poll = time.monotonic() + MODEL_POLL_SECONDS
+        while True:
+            time.sleep(ROLLBACK_CHECK_SECONDS)
+            try:
+                if self.take_rollback_request():
+                    self.rollback()
+                    recycle()
+                elif MODEL_POLL_SECONDS > 0 and time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + MODEL_POLL_SECONDS
+                    if self.check_for_update():
+                        recycle()
+            except Exception:
+                self.logger.error("Model update check failed.", exc_info=True)
+
+    def check_for_update(self):
+        version, prefix = self.model_store.latest()
+        if version is None or version == self.current.version or version in self.skipped_versions:
+            return False
+        self.logger.info(f"New model version {version} published, loading it in the background.")
+        # A failed download is retried on the next poll; a model that does not load is skipped
+        version, local_dir, timings = self.model_store.fetch(version, prefix)
+        try:
+            model, tokenizer, load_ms = self.model_store.load(local_dir)
+            serving = self.build_serving(model, tokenizer, version, local_dir)
+        except Exception:
+            self.skipped_versions.add(version)
+            raise
+        serving.timings.update(timings, load_ms=load_ms)
+        self.swap(serving)
+        return True
+
+    def swap(self, serving):
+        with self.lock:
+            self.previous, self.current = self.current, serving
+            self.model_store.prune([serving.model_dir, self.previous.model_dir])
+        metrics.record_serving_model(serving)
+        self.logger.info(f"Serving model version {serving.version} (previous {self.previous.version}), "
+                         f"timings (ms): {serving.timings}")
+
+    def rollback_target(self):
+        if self.previous is None:
+            raise ValueError("No previous model version to roll back to.")
+        if self.previous.version in self.skipped_versions:
+            raise ValueError(f"Model version {self.previous.version} was rolled back or failed to load.")
+        return self.previous.version
+
+    # Swap back to the previously served model and stop polling from re-selecting the bad one
+    def rollback(self):
+        with self.lock:
+            self.rollback_target()
+            self.skipped_versions.add(self.current.version)
+            self.previous, self.current = self.current, self.previous
+            serving = self.current
+        metrics.record_serving_model(serving)
+        self.logger.warning(f"Rolled back to model version {serving.version}.")
+        return serving.version
+
+    # Workers of a reloading master ask it to roll back; it then recycles them
+    def request_rollback(self):
+        version = self.rollback_target()
+        with open(os.path.join(self.model_store.local_root, ROLLBACK_REQUEST_NAME), "w") as f:
+            f.write(version)
+        self.logger.warning(f"Requested a rollback to model version {version} from the master.")
+        return version
+
+    def take_rollback_request(self):
+        try:
+            os.remove(os.path.join(self.model_store.local_root, ROLLBACK_REQUEST_NAME))
+        except FileNotFoundError:
+            return False
+        return True
@@ -0,0 +1,203 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+MODEL_DOWNLOAD_WORKERS = int(os.environ.get("MODEL_DOWNLOAD_WORKERS", "8"))
+ARTIFACT_INDEX_NAME = ".artifact_index.json"
+# Processes sharing local_root (workers of a pod) fetch and prune under this lock
+LOCK_FILE_NAME = ".model_store.lock"
+# The trainer publishes each model under <model_path>versions/<version>/ and then points
+# <model_path>latest.json at it; without a pointer the flat legacy layout is served.
+LATEST_POINTER_NAME = "latest.json"
+# Written by the trainer into each version prefix; lists every file with its key and content hash.
+# Unchanged files point at the object uploaded with an earlier version.
+MODEL_MANIFEST_NAME = "manifest.json"
+LEGACY_VERSION_DIR = "legacy"
+
+
+# Keeps a local copy of the model artifacts under an S3 prefix. Files whose ETag and size
+# match the local index are reused; the rest are downloaded concurrently.
+class ModelStore:
+    def __init__(self, s3_client, bucket, logger, model_path="models/", local_root=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.logger = logger
+        self.model_path = model_path
+        self.local_root = local_root
+
+    # Model files are the direct children of the prefix
+    def list_artifacts(self, prefix):
+        artifacts = []
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix}
+        while True:
+            response = self.s3_client.list_objects_v2(**kwargs)
+            artifacts.extend(obj for obj in response.get("Contents", [])
+                             if obj["Key"][len(prefix):] and "/" not in obj["Key"][len(prefix):]
+                             and os.path.basename(obj["Key"]) != LATEST_POINTER_NAME)
+            if not response.get("IsTruncated"):
+                return artifacts
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    # Artifacts listed in the version's manifest, or None for versions published without one.
+    # The content hash stands in for the ETag, so identical files match across versions.
+    def manifest_artifacts(self, prefix):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{prefix}{MODEL_MANIFEST_NAME}")
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        manifest = json.loads(response["Body"].read())
+        return [{"Key": entry["key"], "Size": entry["size"], "ETag": entry["sha256"]}
+                for entry in manifest["files"].values()]
+
+    # Identify a set of artifacts by their keys and ETags
+    @staticmethod
+    def artifact_version(artifacts):
+        etags = sorted(f"{obj['Key']}:{obj.get('ETag', '')}" for obj in artifacts)
+        return hashlib.sha256("|".join(etags).encode("utf-8")).hexdigest()[:12]
+
+    @staticmethod
+    def load_index(local_dir):
+        path = os.path.join(local_dir, ARTIFACT_INDEX_NAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def save_index(local_dir, index):
+        path = os.path.join(local_dir, ARTIFACT_INDEX_NAME)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+    # Hard-link an identical file from another local version instead of downloading it again
+    def link_local_copy(self, obj, local_dir):
+        if self.local_root is None:
+            return False
+        file_name = os.path.basename(obj["Key"])
+        target = os.path.join(local_dir, file_name)
+        for name in os.listdir(self.local_root):
+            other_dir = os.path.join(self.local_root, name)
+            if not os.path.isdir(other_dir) or os.path.abspath(other_dir) == os.path.abspath(local_dir):
+                continue
+            cached = ModelStore.load_index(other_dir).get(file_name)
+            source = os.path.join(other_dir, file_name)
+            if (cached is None or cached["etag"] != obj.get("ETag") or not os.path.exists(source)
+                    or os.path.getsize(source) != obj["Size"]):
+                continue
+            if os.path.exists(target):
+                os.remove(target)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            return True
+        return False
+
+    def download_artifact(self, obj, local_dir):
+        file_name = os.path.basename(obj["Key"])
+        local_file_path = os.path.join(local_dir, file_name)
+        part_path = f"{local_file_path}.part-{os.getpid()}"
+        try:
+            self.s3_client.download_file(self.bucket, obj["Key"], part_path)
+            os.replace(part_path, local_file_path)
+            self.logger.info(f"Successfully downloaded {file_name} from S3.")
+        except Exception as e:
+            self.logger.error(f"Error downloading {file_name} from S3: {e}")
+            raise
+
+    # Bring local_dir in line with the prefix; returns the model version and phase timings in ms
+    def sync(self, prefix, local_dir):
+        os.makedirs(local_dir, exist_ok=True)
+        timings = {}
+        start = time.perf_counter()
+        artifacts = self.manifest_artifacts(prefix)
+        if artifacts is None:
+            artifacts = self.list_artifacts(prefix)
+        if not artifacts:
+            raise ValueError(f"No files found in S3 path: {prefix}")
+        timings["list_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        start = time.perf_counter()
+        index = ModelStore.load_index(local_dir)
+        stale = []
+        for obj in artifacts:
+            file_name = os.path.basename(obj["Key"])
+            local_file_path = os.path.join(local_dir, file_name)
+            cached = index.get(file_name)
+            if (cached is None or cached["etag"] != obj.get("ETag") or not os.path.exists(local_file_path)
+                    or os.path.getsize(local_file_path) != obj["Size"]):
+                stale.append(obj)
+        linked = [obj for obj in stale if self.link_local_copy(obj, local_dir)]
+        to_download = [obj for obj in stale if obj not in linked]
+        if to_download:
+            with ThreadPoolExecutor(max_workers=MODEL_DOWNLOAD_WORKERS) as executor:
+                list(executor.map(lambda obj: self.download_artifact(obj, local_dir), to_download))
+        # Drop files from earlier versions that are no longer part of the model
+        current = {os.path.basename(obj["Key"]) for obj in artifacts}
+        for file_name in set(index) - current:
+            if os.path.exists(os.path.join(local_dir, file_name)):
+                os.remove(os.path.join(local_dir, file_name))
+        ModelStore.save_index(local_dir, {
+            os.path.basename(obj["Key"]): {"etag": obj.get("ETag"), "size": obj["Size"]} for obj in artifacts
+        })
+        timings["download_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        self.logger.info(f"Model artifacts: {len(to_download)} downloaded, {len(linked)} linked from other versions, "
+                         f"{len(artifacts) - len(stale)} reused from cache.")
+        return ModelStore.artifact_version(artifacts), timings
+
+    # Returns (version, prefix) of the published model, version is None for the legacy layout
+    def latest(self):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.model_path}{LATEST_POINTER_NAME}")
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None, self.model_path
+            raise
+        pointer = json.loads(response["Body"].read())
+        return pointer["version"], pointer["prefix"]
+
+    # Sync a model version into its own local directory; returns (version, local_dir, timings)
+    def fetch(self, version=None, prefix=None):
+        if prefix is None:
+            version, prefix = self.latest()
+        local_dir = os.path.join(self.local_root, version or LEGACY_VERSION_DIR)
+        with self.lock_file() as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            artifact_version, timings = self.sync(prefix, local_dir)
+        return version or artifact_version, local_dir, timings
+
+    def lock_file(self):
+        os.makedirs(self.local_root, exist_ok=True)
+        return open(os.path.join(self.local_root, LOCK_FILE_NAME), "a")
+
+    @staticmethod
+    def load(local_dir):
+        start = time.perf_counter()
+        # safetensors weights are memory-mapped instead of unpickled into a second copy
+        use_safetensors = os.path.exists(os.path.join(local_dir, "model.safetensors"))
+        # Auto classes load both the MobileBERT teacher and distilled student variants
+        model = AutoModelForSequenceClassification.from_pretrained(local_dir, use_safetensors=use_safetensors,
+                                                                   low_cpu_mem_usage=True)
+        tokenizer = AutoTokenizer.from_pretrained(local_dir, use_fast=True)
+        return model, tokenizer, round((time.perf_counter() - start) * 1000, 2)
+
+    # Remove local model directories other than the ones still in use
+    def prune(self, keep_dirs):
+        keep = {os.path.abspath(path) for path in keep_dirs}
+        with self.lock_file() as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for name in os.listdir(self.local_root):
+                path = os.path.abspath(os.path.join(self.local_root, name))
+                if os.path.isdir(path) and path not in keep:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self.logger.info(f"Removed local model directory {path}")
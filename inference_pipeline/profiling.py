@@ -0,0 +1,166 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import Counter
+
+# Admin endpoints (profiling, model rollback) are disabled unless an admin token is configured
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 50
+
+
+class ProfileInProgressError(Exception):
+    pass
+
+
+# Samples the stacks of every other thread at a fixed interval and counts them in the folded
+# format read by flamegraph.pl and speedscope
+class StackSampler:
+    def __init__(self, interval_ms):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.worker.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# Time-boxed profile of live traffic: torch operator timings and a Chrome trace, sampled
+# Python stacks, and tracemalloc allocation statistics. Only one capture runs at a time;
+# while idle the request path only reads the `active` flag.
+class Profiler:
+    def __init__(self, logger, scheduler):
+        self.logger = logger
+        # Every model forward runs on the scheduler thread
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.active = False
+        self.request_stats_lock = threading.Lock()
+        self.request_allocations = []
+
+    # Called on the request path while a capture runs; under concurrency the delta also includes
+    # allocations made by overlapping requests
+    def record_request(self, traced_before):
+        if not tracemalloc.is_tracing():
+            return
+        traced_after, _ = tracemalloc.get_traced_memory()
+        with self.request_stats_lock:
+            self.request_allocations.append(traced_after - traced_before)
+
+    @staticmethod
+    def traced_memory():
+        return tracemalloc.get_traced_memory()[0]
+
+    # Returns the zip archive as bytes
+    def capture(self, seconds):
+        if not self.lock.acquire(blocking=False):
+            raise ProfileInProgressError("A profile is already being captured.")
+        try:
+            return self.run_capture(min(max(seconds, 0.1), PROFILE_MAX_SECONDS))
+        finally:
+            self.lock.release()
+
+    def run_capture(self, seconds):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        self.logger.warning(f"Capturing a {seconds}s profile of live traffic.")
+        self.request_allocations = []
+        sampler = StackSampler(PROFILE_SAMPLE_INTERVAL_MS)
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        start_snapshot = tracemalloc.take_snapshot()
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        torch_profile = profile(activities=activities, record_shapes=True)
+        started = time.time()
+        try:
+            # The torch profiler only records operators of the thread that started it
+            self.scheduler.call(torch_profile.start)
+            try:
+                sampler.start()
+                self.active = True
+                time.sleep(seconds)
+                self.active = False
+                sampler.stop()
+            finally:
+                self.scheduler.call(torch_profile.stop)
+            end_snapshot = tracemalloc.take_snapshot()
+        finally:
+            self.active = False
+            tracemalloc.stop()
+
+        with tempfile.TemporaryDirectory(prefix="profile-") as tmp_dir:
+            trace_path = os.path.join(tmp_dir, "torch_trace.json")
+            torch_profile.export_chrome_trace(trace_path)
+            with open(trace_path, "rb") as f:
+                chrome_trace = f.read()
+        operators = torch_profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=50)
+        allocations = self.allocation_report(start_snapshot, end_snapshot)
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("torch_trace.json", chrome_trace)
+            zf.writestr("torch_operators.txt", operators)
+            zf.writestr("python_stacks.folded", sampler.folded())
+            zf.writestr("allocations.json", json.dumps(allocations, indent=2))
+            zf.writestr("summary.json", json.dumps({
+                "started_at": started,
+                "duration_s": seconds,
+                "stack_samples": sampler.samples,
+                "sample_interval_ms": PROFILE_SAMPLE_INTERVAL_MS,
+                "requests": len(self.request_allocations)
+            }, indent=2))
+        self.logger.warning(f"Profile captured: {sampler.samples} stack samples, "
+                            f"{len(self.request_allocations)} requests.")
+        return archive.getvalue()
+
+    def allocation_report(self, start_snapshot, end_snapshot):
+        with self.request_stats_lock:
+            per_request = sorted(self.request_allocations)
+        top = end_snapshot.compare_to(start_snapshot, "lineno")[:TOP_ALLOCATIONS]
+        return {
+            "requests": len(per_request),
+            "per_request_traced_bytes": {
+                "mean": sum(per_request) / len(per_request) if per_request else None,
+                "p50": per_request[len(per_request) // 2] if per_request else None,
+                "max": per_request[-1] if per_request else None
+            },
+            "top_growth_by_line": [{
+                "location": str(stat.traceback[0]),
+                "size_diff_bytes": stat.size_diff,
+                "count_diff": stat.count_diff
+            } for stat in top]
+        }
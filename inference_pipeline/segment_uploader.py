@@ -0,0 +1,127 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from boto3.s3.transfer import TransferConfig
+from feedback_writer import SEGMENT_SUFFIX
+
+# Sealed segments are shipped every interval and whenever an upload is requested
+UPLOAD_INTERVAL_SECONDS = float(os.environ.get("UPLOAD_INTERVAL_SECONDS", "300"))
+UPLOAD_MAX_RETRIES = int(os.environ.get("UPLOAD_MAX_RETRIES", "5"))
+UPLOAD_RETRY_BASE_SECONDS = float(os.environ.get("UPLOAD_RETRY_BASE_SECONDS", "1"))
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=4)
+
+SEGMENT_PREFIX = "segments/"
+MANIFEST_NAME = "manifest.json"
+STATE_FILE_NAME = "uploaded.json"
+LOCK_FILE_NAME = ".upload.lock"
+
+
+# Ships sealed feedback segments to <data_prefix>segments/<pod>/ and maintains a per-pod
+# manifest listing every uploaded segment for the trainer. Worker processes of one pod share
+# the segment directory; an upload cycle runs under a file lock so only one ships at a time.
+class SegmentUploader:
+    def __init__(self, s3_client, bucket, data_prefix, segment_dir, logger, pod_name, seal):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.pod_prefix = f"{data_prefix}{SEGMENT_PREFIX}{pod_name}/"
+        self.segment_dir = segment_dir
+        self.logger = logger
+        self.pod_name = pod_name
+        # Callable sealing the open segment and returning all sealed segment paths
+        self.seal = seal
+        self.state_path = os.path.join(segment_dir, STATE_FILE_NAME)
+        self.lock_path = os.path.join(segment_dir, LOCK_FILE_NAME)
+        self.uploaded = self.load_state()
+        # Re-publish on startup in case the last manifest write did not go through
+        self.manifest_dirty = bool(self.uploaded)
+        self.last_error = None
+        self.trigger = threading.Event()
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self.run, name="segment-uploader", daemon=True)
+        self.worker.start()
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r") as f:
+            return json.load(f)
+
+    def save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.uploaded, f)
+        os.replace(tmp_path, self.state_path)
+
+    def request_upload(self):
+        self.trigger.set()
+
+    def run(self):
+        while True:
+            self.trigger.wait(timeout=UPLOAD_INTERVAL_SECONDS if UPLOAD_INTERVAL_SECONDS > 0 else None)
+            self.trigger.clear()
+            try:
+                self.upload_pending()
+                self.last_error = None
+            except Exception as ex:
+                self.last_error = str(ex)
+                self.logger.error("Failed to upload feedback segments to S3.", exc_info=True)
+
+    def with_retries(self, action, description):
+        for attempt in range(UPLOAD_MAX_RETRIES):
+            try:
+                return action()
+            except Exception:
+                if attempt == UPLOAD_MAX_RETRIES - 1:
+                    raise
+                delay = UPLOAD_RETRY_BASE_SECONDS * 2 ** attempt
+                self.logger.warning(f"{description} failed, retrying in {delay}s.", exc_info=True)
+                time.sleep(delay)
+
+    # Upload only segments not shipped before, then publish the manifest
+    def upload_pending(self):
+        sealed = self.seal()
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another worker may have shipped segments since this one last looked
+            self.uploaded = self.load_state()
+            return self.upload_segments(sealed)
+
+    def upload_segments(self, sealed):
+        pending = [path for path in sealed if os.path.basename(path) not in self.uploaded and os.path.exists(path)]
+        for path in pending:
+            name = os.path.basename(path)
+            key = f"{self.pod_prefix}{name}"
+            size = os.path.getsize(path)
+            self.with_retries(lambda: self.s3_client.upload_file(path, self.bucket, key, Config=TRANSFER_CONFIG),
+                              f"Upload of {name}")
+            self.uploaded[name] = {"key": key, "size": size, "uploaded_at": time.time()}
+            self.save_state()
+            os.remove(path)
+            self.manifest_dirty = True
+            self.logger.info(f"Uploaded feedback segment to s3://{self.bucket}/{key}")
+        if self.manifest_dirty:
+            self.with_retries(self.write_manifest, "Manifest upload")
+            self.manifest_dirty = False
+        return len(pending)
+
+    def write_manifest(self):
+        manifest = {
+            "pod": self.pod_name,
+            "updated_at": time.time(),
+            "segments": sorted(self.uploaded.values(), key=lambda segment: segment["key"])
+        }
+        self.s3_client.put_object(Bucket=self.bucket, Key=f"{self.pod_prefix}{MANIFEST_NAME}",
+                                  Body=json.dumps(manifest).encode("utf-8"), ContentType="application/json")
+
+    def stats(self):
+        return {
+            "uploaded_segments": len(self.uploaded),
+            "pending_segments": len([name for name in os.listdir(self.segment_dir)
+                                     if name.endswith(SEGMENT_SUFFIX) and name not in self.uploaded]),
+            "last_error": self.last_error
+        }
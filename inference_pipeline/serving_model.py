@@ -0,0 +1,75 @@
+import os
+import time
+import torch
+from inference_backends import INFERENCE_BACKEND, PARITY_MIN_AGREEMENT, WARMUP_TEXTS, EagerBackend, create_backend, label_agreement, pad_batch, parity_sample_texts
+
+# Longer inputs are truncated, capped by the model's position embeddings and the length the
+# tokenizer was saved with (a distilled student is trained on shorter inputs)
+MAX_SEQUENCE_LENGTH = int(os.environ.get("MAX_SEQUENCE_LENGTH", "512"))
+
+
+# One loaded model version: tokenizer, inference backend and the code shared by every engine.
+# FeedbackAnalysis swaps whole instances, so a request always sees a consistent set.
+class ServingModel:
+    def __init__(self, model, tokenizer, version, model_dir, device, logger, backend_name=INFERENCE_BACKEND):
+        self.tokenizer = tokenizer
+        self.version = version
+        self.model_dir = model_dir
+        self.device = device
+        self.logger = logger
+        self.max_length = min(MAX_SEQUENCE_LENGTH, model.config.max_position_embeddings, tokenizer.model_max_length)
+        self.pad_id = tokenizer.pad_token_id or 0
+        self.timings = {}
+        start = time.perf_counter()
+        self.backend = self.load_backend(model, backend_name)
+        self.timings["backend_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        start = time.perf_counter()
+        self.warm_up()
+        self.timings["warmup_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    # Build the configured backend and verify it agrees with fp32 before serving it
+    def load_backend(self, model, backend_name):
+        reference = EagerBackend(model, self.device)
+        if backend_name == reference.name:
+            return reference
+        try:
+            backend = create_backend(backend_name, model, self.device, self.model_dir, self.version, self.logger)
+            sample_input_ids = self.encode_texts(parity_sample_texts())
+            agreement = label_agreement(backend, reference, sample_input_ids, self.pad_id)
+        except Exception:
+            self.logger.error(f"Failed to initialize {backend_name} backend, serving fp32.", exc_info=True)
+            return reference
+        self.logger.info(f"Backend {backend_name} label agreement with fp32: {round(agreement, 4)}")
+        if agreement < PARITY_MIN_AGREEMENT:
+            self.logger.error(f"Backend {backend_name} failed the parity check ({round(agreement, 4)} < "
+                              f"{PARITY_MIN_AGREEMENT}), serving fp32.")
+            return reference
+        return backend
+
+    # Run the first forwards before traffic arrives so lazy initialization is off the request path
+    def warm_up(self):
+        sample_input_ids = self.encode_texts(WARMUP_TEXTS)
+        for batch_size in (1, len(sample_input_ids)):
+            self.predict_batch(sample_input_ids[:batch_size])
+
+    # Run one padded forward pass over a batch of token id lists
+    def predict_batch(self, batch_input_ids):
+        input_ids, attention_mask = pad_batch(batch_input_ids, self.pad_id)
+        logits = self.backend.logits(input_ids, attention_mask)
+        return torch.argmax(logits, dim=1).tolist()
+
+    # Batch-encode with the fast tokenizer, adding [CLS]/[SEP] and truncating to max_length
+    def encode_texts(self, texts):
+        encodings = self.tokenizer([text.lower() for text in texts], truncation=True, max_length=self.max_length)
+        return encodings["input_ids"]
+
+    def encode_text(self, text):
+        return self.encode_texts([text])[0]
+
+    # Pre-tokenized requests must fit this model as-is
+    def validate_input_ids(self, input_ids):
+        if not input_ids or len(input_ids) > self.max_length:
+            raise ValueError(f"input_ids must contain between 1 and {self.max_length} tokens")
+        vocab_size = len(self.tokenizer)
+        if any(token_id < 0 or token_id >= vocab_size for token_id in input_ids):
+            raise ValueError(f"input_ids must be between 0 and {vocab_size - 1}")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Each pipeline runs from its own directory and imports its modules by name
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("inference_pipeline", "training_pipeline", "file_processing"):
+    sys.path.insert(0, os.path.join(REPO_ROOT, directory))
@@ -0,0 +1,82 @@
+import fcntl
+import glob
+import gzip
+import json
+import logging
+import os
+import pytest
+
+import feedback_writer
+from feedback_writer import OPEN_SUFFIX, SEGMENT_SUFFIX, FeedbackWriter, sealed_segments
+
+
+@pytest.fixture
+def segment_dir(tmp_path):
+    return str(tmp_path / "segments")
+
+
+def create_writer(segment_dir, pod_name="pod-a"):
+    return FeedbackWriter(segment_dir, logging.getLogger("test_feedback_writer"), pod_name)
+
+
+# Recovered segments end at their last flush, without a gzip trailer
+def read_segment(path):
+    records = []
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                records.append(json.loads(line))
+        except EOFError:
+            pass
+    return records
+
+
+def open_segments(segment_dir):
+    return glob.glob(os.path.join(segment_dir, f"*{OPEN_SUFFIX}"))
+
+
+def test_seal_writes_queued_records(segment_dir):
+    writer = create_writer(segment_dir)
+    records = [{"text": "Great product", "stars": 5}, {"text": "Broke after a day", "stars": 1}]
+    for record in records:
+        assert writer.put(record)
+
+    sealed = writer.seal()
+    assert len(sealed) == 1
+    assert read_segment(sealed[0]) == records
+    assert open_segments(segment_dir) == []
+
+
+def test_recovery_skips_segments_of_live_writers(segment_dir):
+    live = create_writer(segment_dir, "pod-live")
+    live.put({"text": "Still being written", "stars": 3})
+    with live.lock:
+        live.write_batch(live.drain(0))
+    # A writer that died with its segment open: the file is there but nobody holds its lock
+    dead = create_writer(segment_dir, "pod-dead")
+    dead.put({"text": "Written before the crash", "stars": 4})
+    with dead.lock:
+        dead.write_batch(dead.drain(0))
+    fcntl.flock(dead.raw_file, fcntl.LOCK_UN)
+
+    create_writer(segment_dir).recover_open_segments()
+    assert open_segments(segment_dir) == [f"{live.segment_path}{OPEN_SUFFIX}"]
+    assert [read_segment(path) for path in sealed_segments(segment_dir)] == [
+        [{"text": "Written before the crash", "stars": 4}]]
+
+
+def test_recovery_does_not_recreate_a_segment_sealed_after_listing(segment_dir, monkeypatch):
+    writer = create_writer(segment_dir)
+    writer.put({"text": "Sealed while another worker starts", "stars": 2})
+    with writer.lock:
+        writer.write_batch(writer.drain(0))
+    open_path = f"{writer.segment_path}{OPEN_SUFFIX}"
+    listed = glob.glob(os.path.join(segment_dir, f"*{SEGMENT_SUFFIX}{OPEN_SUFFIX}"))
+    writer.seal()
+    # The recovering worker still sees the listing taken before the seal
+    monkeypatch.setattr(feedback_writer.glob, "glob", lambda pattern: listed)
+
+    create_writer(segment_dir).recover_open_segments()
+    assert not os.path.exists(open_path)
+    assert read_segment(open_path[:-len(OPEN_SUFFIX)]) == [
+        {"text": "Sealed while another worker starts", "stars": 2}]
@@ -0,0 +1,123 @@
+import importlib
+import json
+import logging
+import os
+import sys
+import pytest
+
+for module_name in ("boto3", "torch", "transformers", "datasets", "vaderSentiment"):
+    pytest.importorskip(module_name)
+
+from local_s3 import LocalS3Client
+from model_store import ModelStore
+
+BUCKET = "customerfeedbackmlbucket"
+
+
+# Records every object written and downloaded, in order
+class RecordingS3Client(LocalS3Client):
+    def __init__(self, root):
+        super().__init__(root)
+        self.writes = []
+        self.downloads = []
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        super().upload_file(Filename, Bucket, Key, **kwargs)
+        self.writes.append(Key)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        response = super().put_object(Bucket, Key, Body, **kwargs)
+        self.writes.append(Key)
+        return response
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        super().download_file(Bucket, Key, Filename, **kwargs)
+        self.downloads.append(Key)
+
+
+@pytest.fixture
+def trainer(tmp_path, monkeypatch):
+    # The trainer creates its working directories under the home directory on import
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("S3_LOCAL_ROOT", str(tmp_path / "s3"))
+    sys.modules.pop("trainer_script", None)
+    trainer_script = importlib.import_module("trainer_script")
+    assert isinstance(trainer_script.s3_client, LocalS3Client)
+    monkeypatch.setattr(trainer_script, "s3_client", RecordingS3Client(str(tmp_path / "s3")))
+    yield trainer_script
+    sys.modules.pop("trainer_script", None)
+
+
+def save_model(model_dir, weights):
+    os.makedirs(model_dir, exist_ok=True)
+    files = {"config.json": b'{"num_labels": 5}', "tokenizer.json": b'{"model": {"vocab": {}}}',
+             "model.safetensors": weights}
+    for file_name, content in files.items():
+        with open(os.path.join(model_dir, file_name), "wb") as f:
+            f.write(content)
+
+
+def read_json(client, key):
+    return json.loads(client.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+
+def test_publish_uploads_changed_files_and_fetch_reuses_the_rest(trainer, tmp_path):
+    client = trainer.s3_client
+    model_dir = str(tmp_path / "model")
+    save_model(model_dir, b"weights-1" * 1000)
+    trainer.publish_model(model_dir, version="v1")
+    save_model(model_dir, b"weights-2" * 1000)
+    client.writes.clear()
+    trainer.publish_model(model_dir, version="v2")
+
+    first = read_json(client, "models/versions/v1/manifest.json")["files"]
+    second = read_json(client, "models/versions/v2/manifest.json")["files"]
+    # Unchanged files keep pointing at the objects uploaded with v1
+    for file_name in ("config.json", "tokenizer.json"):
+        assert second[file_name] == first[file_name]
+        assert second[file_name]["key"] == f"models/versions/v1/{file_name}"
+    assert second["model.safetensors"]["key"] == "models/versions/v2/model.safetensors"
+    assert second["model.safetensors"]["sha256"] != first["model.safetensors"]["sha256"]
+    # Only the changed weights are uploaded, then the manifest, and the latest pointer last
+    assert client.writes == ["models/versions/v2/model.safetensors", "models/versions/v2/manifest.json",
+                             "models/latest.json"]
+    pointer = read_json(client, "models/latest.json")
+    assert pointer["version"] == "v2"
+    assert pointer["manifest"] == "models/versions/v2/manifest.json"
+
+    store = ModelStore(client, BUCKET, logging.getLogger("test_model_publishing"), local_root=str(tmp_path / "local"))
+    _, v1_dir, _ = store.fetch("v1", "models/versions/v1/")
+    client.downloads.clear()
+    version, v2_dir, _ = store.fetch()
+    assert version == "v2"
+    assert client.downloads == ["models/versions/v2/model.safetensors"]
+    for file_name in ("config.json", "tokenizer.json"):
+        assert os.path.samefile(os.path.join(v1_dir, file_name), os.path.join(v2_dir, file_name))
+    with open(os.path.join(v2_dir, "model.safetensors"), "rb") as f:
+        assert f.read() == b"weights-2" * 1000
+
+
+def test_fetch_published_model_follows_the_latest_pointer(trainer, tmp_path):
+    model_dir = str(tmp_path / "model")
+    save_model(model_dir, b"weights-1" * 1000)
+    trainer.publish_model(model_dir, version="v1")
+    local_dir = str(tmp_path / "teacher")
+    os.makedirs(local_dir)
+    with open(os.path.join(local_dir, "stale.bin"), "wb") as f:
+        f.write(b"left over from an earlier version")
+    assert trainer.fetch_published_model(local_dir) == "v1"
+
+    save_model(model_dir, b"weights-2" * 1000)
+    trainer.publish_model(model_dir, version="v2")
+    trainer.s3_client.downloads.clear()
+    assert trainer.fetch_published_model(local_dir) == "v2"
+    # Files already matching the manifest are not downloaded again
+    assert trainer.s3_client.downloads == ["models/versions/v2/model.safetensors"]
+    assert sorted(os.listdir(local_dir)) == ["config.json", "model.safetensors", "tokenizer.json"]
+    with open(os.path.join(local_dir, "model.safetensors"), "rb") as f:
+        assert f.read() == b"weights-2" * 1000
+
+
+def test_fetch_published_model_without_a_published_version(trainer, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        trainer.fetch_published_model(str(tmp_path))
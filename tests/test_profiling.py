@@ -0,0 +1,42 @@
+import io
+import logging
+import threading
+import zipfile
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from batch_scheduler import BatchScheduler
+from profiling import Profiler
+
+
+def test_capture_records_model_operators_under_load():
+    model = torch.nn.Sequential(torch.nn.Linear(32, 64), torch.nn.ReLU(), torch.nn.Linear(64, 5)).eval()
+
+    def forward(items):
+        with torch.no_grad():
+            return torch.argmax(model(torch.stack(items)), dim=1).tolist()
+
+    logger = logging.getLogger("test_profiling")
+    scheduler = BatchScheduler(forward, logger, max_batch_size=8, max_wait_ms=1)
+    scheduler.start()
+    profiler = Profiler(logger, scheduler)
+    stopped = threading.Event()
+
+    def send_requests():
+        while not stopped.is_set():
+            scheduler.submit(torch.randn(32))
+
+    clients = [threading.Thread(target=send_requests, daemon=True) for _ in range(4)]
+    for client in clients:
+        client.start()
+    try:
+        archive = profiler.capture(1.0)
+    finally:
+        stopped.set()
+        for client in clients:
+            client.join()
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        operators = zf.read("torch_operators.txt").decode("utf-8")
+    assert "aten::addmm" in operators or "aten::linear" in operators
@@ -0,0 +1,137 @@
+import gzip
+import json
+import logging
+import os
+import pytest
+
+pytest.importorskip("boto3")
+
+import segment_uploader
+from feedback_writer import SEGMENT_SUFFIX, sealed_segments
+from local_s3 import LocalS3Client
+from segment_uploader import SegmentUploader
+
+BUCKET = "customerfeedbackmlbucket"
+POD = "pod-a"
+MANIFEST_KEY = f"datasets/segments/{POD}/manifest.json"
+
+
+# Fails the first `failures` uploads and records the keys of the successful ones
+class FlakyS3Client(LocalS3Client):
+    def __init__(self, root, failures=0):
+        super().__init__(root)
+        self.failures = failures
+        self.uploaded_keys = []
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("Simulated upload failure")
+        super().upload_file(Filename, Bucket, Key, **kwargs)
+        self.uploaded_keys.append(Key)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(segment_uploader, "UPLOAD_MAX_RETRIES", 3)
+    monkeypatch.setattr(segment_uploader, "UPLOAD_RETRY_BASE_SECONDS", 0)
+
+
+@pytest.fixture
+def segment_dir(tmp_path):
+    path = tmp_path / "segments"
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def client(tmp_path):
+    return FlakyS3Client(str(tmp_path / "s3"))
+
+
+def create_uploader(client, segment_dir):
+    return SegmentUploader(client, BUCKET, "datasets/", segment_dir, logging.getLogger("test_segment_uploader"), POD,
+                           lambda: sealed_segments(segment_dir))
+
+
+def write_segment(segment_dir, name, records):
+    path = os.path.join(segment_dir, f"{name}{SEGMENT_SUFFIX}")
+    with gzip.open(path, "wt") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return path
+
+
+def read_manifest(client):
+    return json.loads(client.get_object(Bucket=BUCKET, Key=MANIFEST_KEY)["Body"].read())
+
+
+def segment_key(name):
+    return f"datasets/segments/{POD}/{name}{SEGMENT_SUFFIX}"
+
+
+def test_uploads_only_segments_not_shipped_before(client, segment_dir):
+    uploader = create_uploader(client, segment_dir)
+    write_segment(segment_dir, "feedback-1", [{"text": "Great product", "stars": 5}])
+    write_segment(segment_dir, "feedback-2", [{"text": "Broke after a day", "stars": 1}])
+    assert uploader.upload_pending() == 2
+
+    write_segment(segment_dir, "feedback-3", [{"text": "It is okay", "stars": 3}])
+    assert uploader.upload_pending() == 1
+    assert uploader.upload_pending() == 0
+    assert client.uploaded_keys == [segment_key("feedback-1"), segment_key("feedback-2"), segment_key("feedback-3")]
+    # Shipped segments are removed locally
+    assert sealed_segments(segment_dir) == []
+
+
+def test_manifest_lists_every_uploaded_segment(client, segment_dir):
+    uploader = create_uploader(client, segment_dir)
+    sizes = {
+        segment_key("feedback-1"): os.path.getsize(write_segment(segment_dir, "feedback-1", [{"text": "a", "stars": 2}])),
+        segment_key("feedback-2"): os.path.getsize(write_segment(segment_dir, "feedback-2", [{"text": "b", "stars": 4}]))
+    }
+    uploader.upload_pending()
+
+    manifest = read_manifest(client)
+    assert manifest["pod"] == POD
+    assert [segment["key"] for segment in manifest["segments"]] == sorted(sizes)
+    assert {segment["key"]: segment["size"] for segment in manifest["segments"]} == sizes
+    for segment in manifest["segments"]:
+        assert client.head_object(Bucket=BUCKET, Key=segment["key"])["ContentLength"] == segment["size"]
+
+
+def test_state_survives_restart(client, segment_dir):
+    records = [{"text": "Arrived on time", "stars": 4}]
+    write_segment(segment_dir, "feedback-1", records)
+    create_uploader(client, segment_dir).upload_pending()
+    # The manifest write did not go through before the restart
+    os.remove(client.object_path(BUCKET, MANIFEST_KEY))
+    # A local copy left behind by a crash between upload and removal
+    write_segment(segment_dir, "feedback-1", records)
+
+    restarted = create_uploader(client, segment_dir)
+    assert restarted.upload_pending() == 0
+    assert client.uploaded_keys == [segment_key("feedback-1")]
+    assert [segment["key"] for segment in read_manifest(client)["segments"]] == [segment_key("feedback-1")]
+
+
+def test_failed_upload_is_retried(client, segment_dir):
+    client.failures = 2
+    uploader = create_uploader(client, segment_dir)
+    write_segment(segment_dir, "feedback-1", [{"text": "Works fine", "stars": 4}])
+    assert uploader.upload_pending() == 1
+    assert client.uploaded_keys == [segment_key("feedback-1")]
+    assert [segment["key"] for segment in read_manifest(client)["segments"]] == [segment_key("feedback-1")]
+
+
+def test_upload_failing_every_retry_is_shipped_next_cycle(client, segment_dir):
+    client.failures = segment_uploader.UPLOAD_MAX_RETRIES
+    uploader = create_uploader(client, segment_dir)
+    write_segment(segment_dir, "feedback-1", [{"text": "Works fine", "stars": 4}])
+    with pytest.raises(ConnectionError):
+        uploader.upload_pending()
+    assert len(sealed_segments(segment_dir)) == 1
+    assert uploader.stats()["uploaded_segments"] == 0
+
+    assert uploader.upload_pending() == 1
+    assert client.uploaded_keys == [segment_key("feedback-1")]
@@ -1,12 +1,24 @@
 import torch
-from torch.utils.data import Dataset
-from transformers import MobileBertTokenizer, MobileBertForSequenceClassification, Trainer, TrainingArguments, MobileBertConfig
+from transformers import MobileBertTokenizerFast, MobileBertForSequenceClassification, Trainer, TrainingArguments, MobileBertConfig, DataCollatorWithPadding, AutoConfig, AutoModelForSequenceClassification
 from datasets import load_dataset, ClassLabel
+from datasets.fingerprint import Hasher
+import gzip
+import hashlib
 import json
 import logging
+import multiprocessing
+import numpy as np
+import random
+import shutil
+import sqlite3
+import sys
+import zlib
 import boto3
 import os
+import time
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 # Set up logging
@@ -17,121 +29,450 @@ logging.basicConfig(level=logging.INFO)
 S3_BUCKET = "customerfeedbackmlbucket"
 MODEL_PATH = "models/"
 NEW_DATA_PATH = "datasets/"
+# Feedback segments uploaded by each inference pod, listed in <pod>/manifest.json
+SEGMENT_PATH = f"{NEW_DATA_PATH}segments/"
+MANIFEST_NAME = "manifest.json"
+# Each trained model is published under its own version prefix; the latest pointer is written last
+LATEST_POINTER_NAME = "latest.json"
+# Lists every file of a version with its content hash; files unchanged since the previous
+# version keep pointing at the object uploaded with that version
+MODEL_MANIFEST_NAME = "manifest.json"
+PUBLISH_WORKERS = int(os.environ.get("PUBLISH_WORKERS", "8"))
+PUBLISH_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024,
+                                         max_concurrency=4)
+# Distilled student models are a separate variant with their own versions and latest pointer;
+# inference pods serve it with MODEL_PATH=models/student/
+STUDENT_MODEL_PATH = f"{MODEL_PATH}student/"
+# TRAINING_MODE=distill trains the student from the current teacher instead of the teacher itself
+TRAINING_MODE = os.environ.get("TRAINING_MODE", "train")
+# Student: a small pretrained BERT sharing MobileBERT's uncased vocabulary, trained on shorter inputs
+STUDENT_BASE_MODEL = os.environ.get("STUDENT_BASE_MODEL", "google/bert_uncased_L-4_H-256_A-4")
+STUDENT_MAX_LENGTH = int(os.environ.get("STUDENT_MAX_LENGTH", "128"))
+DISTILL_TEMPERATURE = float(os.environ.get("DISTILL_TEMPERATURE", "2.0"))
+# Weight of the soft-label KL loss; the rest goes to cross-entropy on the hard labels
+DISTILL_ALPHA = float(os.environ.get("DISTILL_ALPHA", "0.7"))
+DISTILL_EVAL_EXAMPLES = int(os.environ.get("DISTILL_EVAL_EXAMPLES", "2000"))
+# Sequences are truncated, not padded, to this length; batches are padded to their longest member
+MAX_LENGTH = 256
+NUM_CLASSES = 5
+ID2LABEL = {0: "VERY NEGATIVE", 1: "NEGATIVE", 2: "NEUTRAL", 3: "POSITIVE", 4: "VERY POSITIVE"}
+# Worker processes for VADER relabeling
+RELABEL_NUM_PROC = int(os.environ.get("RELABEL_NUM_PROC", os.cpu_count() or 1))
+RELABEL_BATCH_SIZE = 1000
+# Pseudo-labeling streams the feedback file in chunks (one shard each) scored in length-sorted minibatches
+PSEUDO_LABEL_CHUNK_SIZE = int(os.environ.get("PSEUDO_LABEL_CHUNK_SIZE", "10000"))
+PSEUDO_LABEL_BATCH_SIZE = int(os.environ.get("PSEUDO_LABEL_BATCH_SIZE", "64"))
+# Previously trained records mixed into a retraining run, as a fraction of the new records
+REPLAY_FRACTION = float(os.environ.get("REPLAY_FRACTION", "0"))
+# Pending records whose MinHash similarity to one already exported reaches this are left out of the
+# retraining set (file_processing/near_duplicates.py); 0 disables the pass
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0"))
+STAGE_BATCH_SIZE = 1000
 
-s3_client = boto3.client('s3', region_name='eu-central-1')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# S3_LOCAL_ROOT swaps in the inference service's filesystem-backed client (inference_pipeline/local_s3.py),
+# S3_ENDPOINT_URL points the trainer at a stand-in such as moto or MinIO
+S3_LOCAL_ROOT = os.environ.get("S3_LOCAL_ROOT")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+if S3_LOCAL_ROOT:
+    sys.path.append(os.path.join(REPO_ROOT, "inference_pipeline"))
+    from local_s3 import LocalS3Client
+    s3_client = LocalS3Client(S3_LOCAL_ROOT)
+else:
+    s3_client = boto3.client('s3', region_name='eu-central-1', endpoint_url=S3_ENDPOINT_URL)
 
 trainer_dir = os.path.expanduser("~/trainerModel/mobilebert_trained_model")
+student_dir = os.path.expanduser("~/trainerModel/student_model")
+# Latest published teacher, fetched for distillation
+teacher_dir = os.path.expanduser("~/trainerModel/teacher_model")
 result_dir = os.path.expanduser("~/trainerModel/results")
 dataset_dir = os.path.expanduser("~/trainerModel/input")
 logs_dir = os.path.expanduser("~/trainerModel/logs")
+segments_dir = os.path.expanduser("~/trainerModel/input/segments")
+tokenized_dir = os.path.expanduser("~/trainerModel/tokenized")
+relabeled_dir = os.path.expanduser("~/trainerModel/relabeled")
+pseudo_label_dir = os.path.expanduser("~/trainerModel/pseudo_labeled")
+# Consumed segments and every distinct feedback text seen so far, with its pseudo-label once trained on
+feedback_state_file = os.path.expanduser("~/trainerModel/feedback_state.sqlite")
 os.makedirs(trainer_dir, exist_ok=True)
+os.makedirs(student_dir, exist_ok=True)
+os.makedirs(teacher_dir, exist_ok=True)
 os.makedirs(result_dir, exist_ok=True)
 os.makedirs(dataset_dir, exist_ok=True)
 os.makedirs(logs_dir, exist_ok=True)
+os.makedirs(segments_dir, exist_ok=True)
+os.makedirs(tokenized_dir, exist_ok=True)
+os.makedirs(relabeled_dir, exist_ok=True)
 
 analyzer = SentimentIntensityAnalyzer()
 
-# Custom Dataset Class
-class TextDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, num_classes: int, max_length=256):
-        self.texts = texts
-        self.labels = labels
-        self.tokenizer = tokenizer
-        self.num_classes = num_classes
-        self.max_length = max_length
-        for label in self.labels:
-            if label < 0 or label >= self.num_classes:
-                raise ValueError(f"Label {label} out of range. It must be between 0 and {self.num_classes - 1}.")
-
-    def __len__(self):
-        return len(self.texts)
-
-    def __getitem__(self, idx):
-        text = self.texts[idx]
-        label = self.labels[idx]
-        encodings = self.tokenizer(text, truncation=True, padding="max_length", max_length=self.max_length,
-                                   return_tensors="pt")
+# Tokenize once into an Arrow file that is memory-mapped on reuse. The file name carries the source
+# dataset's fingerprint and the tokenizer's hash, so a changed tokenizer or new data is re-tokenized
+# while every later epoch and run reads token ids straight from disk.
+def tokenize_dataset(dataset, tokenizer, text_column, name, max_length=MAX_LENGTH):
+    cache_file = os.path.join(tokenized_dir,
+                              f"{name}-{dataset._fingerprint}-{Hasher.hash(tokenizer)[:16]}-{max_length}.arrow")
+
+    def tokenize(batch):
+        for label in batch["label"]:
+            if label < 0 or label >= NUM_CLASSES:
+                raise ValueError(f"Label {label} out of range. It must be between 0 and {NUM_CLASSES - 1}.")
+        encodings = tokenizer(batch[text_column], truncation=True, max_length=max_length)
         return {
-            "input_ids": encodings["input_ids"].squeeze(0),
-            "attention_mask": encodings["attention_mask"].squeeze(0),
-            "labels": torch.tensor(label, dtype=torch.long)
+            "input_ids": encodings["input_ids"],
+            "attention_mask": encodings["attention_mask"],
+            "labels": batch["label"],
+            "length": [len(ids) for ids in encodings["input_ids"]]
         }
 
+    logger.info(f"Tokenized dataset cache: {cache_file}")
+    return dataset.map(tokenize, batched=True, batch_size=1000, remove_columns=dataset.column_names,
+                       cache_file_name=cache_file, load_from_cache_file=True)
+
 def get_vader_sentiment(text):
     scores = analyzer.polarity_scores(text)
     return scores["compound"]
 
-def relabel_data(example):
-    logger.info(f"Content is: {example['content']}")
-    content = example["content"].strip().lower()
-    if not content:
-        logger.info("Empty content encountered.")
-        example["label"] = 2
-        logger.info(f"Label Assigned for Empty content: {example['label']}")
-        return example
-    sentiment_score = get_vader_sentiment(content)
-    logger.info(f"After calculating the sentiment score: {sentiment_score}")
-    if sentiment_score < -0.5:  # VERY NEGATIVE
-        example["label"] = 0
-    elif -0.5 <= sentiment_score < -0.1:  # NEGATIVE
-        example["label"] = 1
-    elif -0.1 <= sentiment_score <= 0.1:  # NEUTRAL
-        example["label"] = 2
-    elif 0.1 < sentiment_score <= 0.5:  # POSITIVE
-        example["label"] = 3
-    elif 0.5 < sentiment_score <= 1.0:  # VERY POSITIVE
-        example["label"] = 4
-    logger.info(f"Label Assigned for the content based on sentiment score: {example['label']}")
-    return example
-
-# Function for pseudo-label generation
-def generate_pseudo_labels(model, tokenizer, texts, device, confidence_threshold=0.9):
+# Map VADER compound scores to the five classes:
+# < -0.5 VERY NEGATIVE, < -0.1 NEGATIVE, <= 0.1 NEUTRAL, <= 0.5 POSITIVE, otherwise VERY POSITIVE
+def sentiment_labels(scores):
+    scores = np.asarray(scores, dtype=np.float64)
+    return np.select([scores < -0.5, scores < -0.1, scores <= 0.1, scores <= 0.5], [0, 1, 2, 3], default=4)
+
+# Empty content scores 0.0 and so is labelled NEUTRAL
+def vader_labels(texts):
+    contents = [text.strip().lower() for text in texts]
+    scores = [get_vader_sentiment(content) if content else 0.0 for content in contents]
+    return sentiment_labels(scores).tolist()
+
+def relabel_batch(batch):
+    return {"label": vader_labels(batch["content"])}
+
+# Relabel every split with VADER in parallel batches. Results are written to per-split cache files
+# named after the input fingerprint, so a re-run loads them (shard by shard) instead of rescoring.
+def relabel_dataset(dataset_dict, name):
+    cache_file_names = {split: os.path.join(relabeled_dir, f"{name}-{split}-{split_dataset._fingerprint}.arrow")
+                        for split, split_dataset in dataset_dict.items()}
+    relabeled = dataset_dict.map(relabel_batch, batched=True, batch_size=RELABEL_BATCH_SIZE,
+                                 num_proc=RELABEL_NUM_PROC, cache_file_names=cache_file_names,
+                                 load_from_cache_file=True, desc="VADER relabeling")
+    for split, split_dataset in relabeled.items():
+        counts = np.bincount(np.asarray(split_dataset["label"]), minlength=NUM_CLASSES)
+        logger.info(f"Relabeled {len(split_dataset)} {split} examples, per class: {counts.tolist()}")
+    return relabeled
+
+def iter_text_chunks(data_path, chunk_size):
+    chunk = []
+    with open(data_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(json.loads(line)["text"])
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+# Highest class probability and predicted class per text, scored in minibatches of similar length
+def predict_confidences(model, tokenizer, texts, device):
+    encodings = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+    order = np.argsort([len(input_ids) for input_ids in encodings], kind="stable")
+    max_probs = np.empty(len(texts), dtype=np.float32)
+    labels = np.empty(len(texts), dtype=np.int64)
+    with torch.no_grad():
+        for start in range(0, len(order), PSEUDO_LABEL_BATCH_SIZE):
+            indices = order[start:start + PSEUDO_LABEL_BATCH_SIZE]
+            inputs = tokenizer.pad({"input_ids": [encodings[i] for i in indices]}, return_tensors="pt")
+            inputs = {key: val.to(device) for key, val in inputs.items()}
+            probabilities = torch.nn.functional.softmax(model(**inputs).logits, dim=-1)
+            batch_probs, batch_labels = torch.max(probabilities, dim=-1)
+            max_probs[indices] = batch_probs.cpu().numpy()
+            labels[indices] = batch_labels.cpu().numpy()
+    return max_probs, labels
+
+# Function for pseudo-label generation. Texts the model is not confident about fall back to
+# VADER labels, computed in worker processes. Each chunk is written to its own JSONL shard, so
+# memory stays bounded by the chunk size. Returns the shard paths and the number of texts.
+def generate_pseudo_labels(model, tokenizer, data_path, device, confidence_threshold=0.9):
     logger.info("Generating pseudo-labels...")
     model.eval()
-    inputs = tokenizer(texts, truncation=True, padding=True, max_length=256, return_tensors="pt")
-    inputs = {key: val.to(device) for key, val in inputs.items()}
-    with torch.no_grad():
+    shutil.rmtree(pseudo_label_dir, ignore_errors=True)
+    os.makedirs(pseudo_label_dir, exist_ok=True)
+    shard_paths = []
+    total = 0
+    confident_total = 0
+    with multiprocessing.Pool(RELABEL_NUM_PROC) as pool:
+        for shard, texts in enumerate(iter_text_chunks(data_path, PSEUDO_LABEL_CHUNK_SIZE)):
+            max_probs, labels = predict_confidences(model, tokenizer, texts, device)
+            confident = max_probs >= confidence_threshold
+            fallback = np.flatnonzero(~confident)
+            if len(fallback):
+                fallback_texts = [texts[i] for i in fallback]
+                batches = [fallback_texts[start:start + RELABEL_BATCH_SIZE]
+                           for start in range(0, len(fallback_texts), RELABEL_BATCH_SIZE)]
+                labels[fallback] = [label for batch in pool.map(vader_labels, batches) for label in batch]
+
+            shard_path = os.path.join(pseudo_label_dir, f"shard-{shard:05d}.jsonl")
+            with open(f"{shard_path}.part", "w") as out:
+                for text, label, is_confident in zip(texts, labels.tolist(), confident.tolist()):
+                    out.write(json.dumps({"text": text, "label": label,
+                                          "source": "model" if is_confident else "vader"}) + "\n")
+            os.replace(f"{shard_path}.part", shard_path)
+            shard_paths.append(shard_path)
+            total += len(texts)
+            confident_total += int(confident.sum())
+            logger.info(f"Pseudo-labeled {total} texts ({confident_total} confident, "
+                        f"{total - confident_total} VADER fallback) into {len(shard_paths)} shards.")
+    return shard_paths, total
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_json_object(key):
+    try:
+        return json.loads(s3_client.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+
+# Files of the currently published version, empty for the first publish or a version without a manifest
+def latest_manifest_files(model_path):
+    pointer = get_json_object(f"{model_path}{LATEST_POINTER_NAME}")
+    if pointer is None:
+        return {}
+    manifest = get_json_object(pointer.get("manifest", f"{pointer['prefix']}{MODEL_MANIFEST_NAME}"))
+    return manifest["files"] if manifest else {}
+
+# Download the latest published version under model_path into local_dir, keeping local files whose
+# content already matches its manifest
+def fetch_published_model(local_dir, model_path=MODEL_PATH):
+    pointer = get_json_object(f"{model_path}{LATEST_POINTER_NAME}")
+    if pointer is None:
+        raise FileNotFoundError(f"No model published under s3://{S3_BUCKET}/{model_path}")
+    manifest = get_json_object(pointer.get("manifest", f"{pointer['prefix']}{MODEL_MANIFEST_NAME}"))
+    if manifest is None:
+        raise FileNotFoundError(f"Published model version {pointer['version']} has no manifest")
+    files = manifest["files"]
+    for file_name, entry in files.items():
+        local_file_path = os.path.join(local_dir, file_name)
+        if os.path.exists(local_file_path) and file_sha256(local_file_path) == entry["sha256"]:
+            continue
+        s3_client.download_file(S3_BUCKET, entry["key"], f"{local_file_path}.part")
+        os.replace(f"{local_file_path}.part", local_file_path)
+    # Files of an earlier version that the latest one no longer has
+    for file_name in os.listdir(local_dir):
+        if file_name not in files and os.path.isfile(os.path.join(local_dir, file_name)):
+            os.remove(os.path.join(local_dir, file_name))
+    logger.info(f"Fetched published model version {pointer['version']} into {local_dir}")
+    return pointer["version"]
+
+# Publish a saved model as a new immutable version. Only files whose content differs from the
+# latest version are uploaded (concurrently, multipart for large files); the manifest is
+# written once every file is in place and the latest pointer last, so a pod never sees a
+# half-uploaded model.
+def publish_model(model_dir, model_path=MODEL_PATH, version=None):
+    version = version or time.strftime("%Y%m%d%H%M%S", time.gmtime())
+    prefix = f"{model_path}versions/{version}/"
+    previous_files = latest_manifest_files(model_path)
+    files = {}
+    uploads = []
+    for file_name in sorted(os.listdir(model_dir)):
+        local_file_path = os.path.join(model_dir, file_name)
+        if not os.path.isfile(local_file_path):
+            continue
+        sha256 = file_sha256(local_file_path)
+        size = os.path.getsize(local_file_path)
+        previous = previous_files.get(file_name)
+        if previous and previous["sha256"] == sha256 and previous["size"] == size:
+            files[file_name] = previous
+            continue
+        files[file_name] = {"key": f"{prefix}{file_name}", "sha256": sha256, "size": size}
+        uploads.append((local_file_path, files[file_name]["key"]))
+
+    def upload(item):
+        local_file_path, s3_key = item
+        s3_client.upload_file(local_file_path, S3_BUCKET, s3_key, Config=PUBLISH_TRANSFER_CONFIG)
+        logger.info(f"Uploaded {local_file_path} to s3://{S3_BUCKET}/{s3_key}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=PUBLISH_WORKERS) as executor:
+        list(executor.map(upload, uploads))
+    logger.info(f"Uploaded {len(uploads)} changed files, reused {len(files) - len(uploads)} unchanged "
+                f"in {round(time.perf_counter() - start, 2)}s.")
+
+    manifest_key = f"{prefix}{MODEL_MANIFEST_NAME}"
+    manifest = {"version": version, "created_at": time.time(), "files": files}
+    s3_client.put_object(Bucket=S3_BUCKET, Key=manifest_key, Body=json.dumps(manifest, indent=2).encode("utf-8"),
+                         ContentType="application/json")
+    pointer = {"version": version, "prefix": prefix, "manifest": manifest_key, "published_at": time.time()}
+    s3_client.put_object(Bucket=S3_BUCKET, Key=f"{model_path}{LATEST_POINTER_NAME}", Body=json.dumps(pointer).encode("utf-8"),
+                         ContentType="application/json")
+    logger.info(f"Published model version {version} to s3://{S3_BUCKET}/{prefix}")
+    return version
+
+# Amazon Polarity with its two classes replaced by the five VADER-derived sentiment classes
+def load_amazon_polarity():
+    new_labels = ClassLabel(num_classes=5, names=["VERY NEGATIVE", "NEGATIVE", "NEUTRAL", "POSITIVE", "VERY POSITIVE"])
+    amazon_dataset = load_dataset("amazon_polarity")
+    amazon_dataset = amazon_dataset.cast_column("label", new_labels)
+    return relabel_dataset(amazon_dataset, "amazon_polarity")
+
+# Trainer whose loss mixes cross-entropy on the labels with KL divergence to the teacher's
+# temperature-softened class distribution
+class DistillationTrainer(Trainer):
+    def __init__(self, *args, teacher=None, temperature=DISTILL_TEMPERATURE, alpha=DISTILL_ALPHA, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.eval()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
         outputs = model(**inputs)
-        probabilities = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        max_probs, pseudo_labels = torch.max(probabilities, dim=-1)
-
-    # Filter confident labels
-    confident_indices = (max_probs >= confidence_threshold).nonzero(as_tuple=True)[0].cpu().numpy()
-    texts_confident = [texts[i] for i in confident_indices]
-    pseudo_labels_confident = [pseudo_labels[i].item() for i in confident_indices]
-
-    # Fallback for non-confident labels
-    texts_non_confident = [text for i, text in enumerate(texts) if i not in confident_indices]
-    pseudo_labels_non_confident = [relabel_data({"content": text})["label"] for text in texts_non_confident]
-    # Combine results
-    texts_final = texts_confident + texts_non_confident
-    pseudo_labels_final = pseudo_labels_confident + pseudo_labels_non_confident
-    logger.info(f"Final Text is: {texts_final} and Final pseudo label generated is: {pseudo_labels_final}")
-    return texts_final, pseudo_labels_final
+        with torch.no_grad():
+            teacher_logits = self.teacher(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"]).logits
+        soft_loss = torch.nn.functional.kl_div(
+            torch.nn.functional.log_softmax(outputs.logits / self.temperature, dim=-1),
+            torch.nn.functional.softmax(teacher_logits / self.temperature, dim=-1),
+            reduction="batchmean"
+        ) * self.temperature ** 2
+        loss = self.alpha * soft_loss + (1 - self.alpha) * outputs.loss
+        return (loss, outputs) if return_outputs else loss
+
+def model_size_bytes(model_dir):
+    return sum(os.path.getsize(os.path.join(model_dir, name)) for name in os.listdir(model_dir))
+
+# Accuracy against the labels, agreement with the reference model's predictions and CPU latency
+# for single requests and 64-example batches, as served by the inference pods
+def evaluate_model(model, dataset, collator, reference_predictions=None):
+    model = model.to("cpu").eval()
+    predictions = []
+    batch_latencies = []
+    with torch.no_grad():
+        for start in range(0, len(dataset), 64):
+            batch = collator([{key: row[key] for key in ("input_ids", "attention_mask")}
+                              for row in dataset.select(range(start, min(start + 64, len(dataset))))])
+            batch_start = time.perf_counter()
+            logits = model(**batch).logits
+            batch_latencies.append((time.perf_counter() - batch_start) * 1000)
+            predictions.extend(torch.argmax(logits, dim=-1).tolist())
+        single_latencies = []
+        for row in dataset.select(range(min(200, len(dataset)))):
+            single_start = time.perf_counter()
+            model(input_ids=torch.tensor([row["input_ids"]]), attention_mask=torch.tensor([row["attention_mask"]]))
+            single_latencies.append((time.perf_counter() - single_start) * 1000)
+    labels = dataset["labels"]
+    single_latencies.sort()
+    report = {
+        "parameters": sum(parameter.numel() for parameter in model.parameters()),
+        "accuracy": round(float(np.mean(np.asarray(predictions) == np.asarray(labels))), 4),
+        "single_latency_ms_p50": round(single_latencies[len(single_latencies) // 2], 3),
+        "single_latency_ms_p95": round(single_latencies[int(len(single_latencies) * 0.95)], 3),
+        "batch64_latency_ms_mean": round(float(np.mean(batch_latencies)), 3)
+    }
+    if reference_predictions is not None:
+        report["agreement_with_teacher"] = round(
+            float(np.mean(np.asarray(predictions) == np.asarray(reference_predictions))), 4)
+    return report, predictions
+
+# Train a small student to reproduce the published teacher's predictions, publish it as the
+# student variant and store a teacher/student comparison next to it
+def distill_model():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher_version = fetch_published_model(teacher_dir)
+    logger.info(f"Distillation: teacher version {teacher_version}, student base {STUDENT_BASE_MODEL}.")
+    teacher = MobileBertForSequenceClassification.from_pretrained(f"{teacher_dir}").to(device)
+    teacher_tokenizer = MobileBertTokenizerFast.from_pretrained(f"{teacher_dir}")
+    # Same uncased WordPiece vocabulary as the student base, capped at the student's input length
+    tokenizer = MobileBertTokenizerFast.from_pretrained(f"{teacher_dir}", model_max_length=STUDENT_MAX_LENGTH)
+    amazon_dataset = load_amazon_polarity()
+    train_dataset = tokenize_dataset(amazon_dataset["train"], tokenizer, "content", "amazon_polarity",
+                                     max_length=STUDENT_MAX_LENGTH)
+    # The teacher is evaluated as it is served, at MAX_LENGTH; both eval sets hold the same reviews
+    # in the same order, so agreement is compared by index
+    eval_examples = min(DISTILL_EVAL_EXAMPLES, len(amazon_dataset["test"]))
+    eval_dataset = tokenize_dataset(amazon_dataset["test"], tokenizer, "content", "amazon_polarity_test",
+                                    max_length=STUDENT_MAX_LENGTH).shuffle(seed=42).select(range(eval_examples))
+    teacher_eval_dataset = tokenize_dataset(amazon_dataset["test"], teacher_tokenizer, "content", "amazon_polarity_test",
+                                            max_length=MAX_LENGTH).shuffle(seed=42).select(range(eval_examples))
+
+    config = AutoConfig.from_pretrained(
+        STUDENT_BASE_MODEL,
+        num_labels=NUM_CLASSES,
+        id2label=ID2LABEL,
+        label2id={label: idx for idx, label in ID2LABEL.items()},
+        problem_type="single_label_classification"
+    )
+    student = AutoModelForSequenceClassification.from_pretrained(STUDENT_BASE_MODEL, config=config).to(device)
+    collator = DataCollatorWithPadding(tokenizer)
+    distill_args = TrainingArguments(
+        output_dir=f"{result_dir}/student",
+        save_steps=1000,
+        save_total_limit=2,
+        eval_strategy="no",
+        learning_rate=1e-4,
+        per_device_train_batch_size=128,
+        num_train_epochs=3,
+        logging_dir=f"{logs_dir}/student",
+        logging_steps=1000,
+        group_by_length=True,
+        length_column_name="length",
+    )
+    distiller = DistillationTrainer(
+        model=student,
+        args=distill_args,
+        train_dataset=train_dataset,
+        data_collator=collator,
+        teacher=teacher
+    )
+    distiller.train()
+
+    student.save_pretrained(student_dir, safe_serialization=True)
+    tokenizer.save_pretrained(student_dir)
+    teacher_report, teacher_predictions = evaluate_model(teacher, teacher_eval_dataset,
+                                                         DataCollatorWithPadding(teacher_tokenizer))
+    student_report, _ = evaluate_model(student, eval_dataset, collator, teacher_predictions)
+    teacher_report["size_bytes"] = model_size_bytes(teacher_dir)
+    student_report["size_bytes"] = model_size_bytes(student_dir)
+    report = {
+        "eval_examples": eval_examples,
+        "teacher_version": teacher_version,
+        "teacher_max_length": MAX_LENGTH,
+        "student_base_model": STUDENT_BASE_MODEL,
+        "student_max_length": STUDENT_MAX_LENGTH,
+        "temperature": DISTILL_TEMPERATURE,
+        "alpha": DISTILL_ALPHA,
+        "teacher": teacher_report,
+        "student": student_report
+    }
+    with open(os.path.join(student_dir, "distillation_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Distillation report: {json.dumps(report)}")
+    publish_model(student_dir, STUDENT_MODEL_PATH)
+    logger.info(f"Student model saved to {student_dir}")
 
 # Function to train the model
-def train_model(data_path, is_initial_training):
+def train_model(data_path, is_initial_training, feedback_state=None):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    id2label = {0: "VERY NEGATIVE", 1: "NEGATIVE", 2: "NEUTRAL", 3: "POSITIVE", 4: "VERY POSITIVE"}
-    label2id = {label: idx for idx, label in id2label.items()}
+    label2id = {label: idx for idx, label in ID2LABEL.items()}
     config = MobileBertConfig.from_pretrained(
         "google/mobilebert-uncased",
         num_labels=5,
-        id2label=id2label,
+        id2label=ID2LABEL,
         label2id=label2id,
         problem_type="single_label_classification"
     )
     # Load default dataset for initial training else retrain on new dataset
     if is_initial_training:
         logger.info("Initial training: Loading Amazon Polarity dataset.")
-        new_labels = ClassLabel(num_classes=5, names=["VERY NEGATIVE", "NEGATIVE", "NEUTRAL", "POSITIVE", "VERY POSITIVE"])
-        amazon_dataset = load_dataset("amazon_polarity")
-        amazon_dataset = amazon_dataset.cast_column("label", new_labels)
-        amazon_dataset = amazon_dataset.map(relabel_data)
-        amazon_texts = amazon_dataset["train"]["content"]
-        amazon_labels = amazon_dataset["train"]["label"]
-        tokenizer = MobileBertTokenizer.from_pretrained("google/mobilebert-uncased", model_max_length=256)
-        amazon_train_dataset = TextDataset(amazon_texts, amazon_labels, tokenizer, num_classes=5, max_length=256)
+        amazon_dataset = load_amazon_polarity()
+        tokenizer = MobileBertTokenizerFast.from_pretrained("google/mobilebert-uncased", model_max_length=MAX_LENGTH)
+        amazon_train_dataset = tokenize_dataset(amazon_dataset["train"], tokenizer, "content", "amazon_polarity")
         logger.info("Training on Amazon Polarity dataset...")
         model = MobileBertForSequenceClassification.from_pretrained("google/mobilebert-uncased", config=config)
         model.to(device)
@@ -145,44 +486,46 @@ def train_model(data_path, is_initial_training):
             num_train_epochs=3,
             logging_dir=f"{logs_dir}",
             logging_steps=1000,
+            # Batches of similar length keep dynamic padding short
+            group_by_length=True,
+            length_column_name="length",
         )
 
         trainer = Trainer(
             model=model,
             args=training_args,
-            train_dataset=amazon_train_dataset
+            train_dataset=amazon_train_dataset,
+            data_collator=DataCollatorWithPadding(tokenizer)
         )
 
         trainer.train()
 
         # Save the initial trained model
         initial_model_dir = f"{trainer_dir}"
-        model.save_pretrained(initial_model_dir)
+        model.save_pretrained(initial_model_dir, safe_serialization=True)
         tokenizer.save_pretrained(initial_model_dir)
-        for file_name in os.listdir(initial_model_dir):
-            local_file_path = os.path.join(initial_model_dir, file_name)
-            s3_key = f"{MODEL_PATH}{file_name}"
-            s3_client.upload_file(local_file_path, S3_BUCKET, s3_key)
-            logger.info(f"Uploaded {local_file_path} to s3://{S3_BUCKET}/{s3_key}")
+        publish_model(initial_model_dir)
         logger.info(f"Initial model saved to {initial_model_dir}")
 
     else:
         logger.info(f"Retraining: Loading new unlabeled dataset from {data_path}.")
-        tokenizer = MobileBertTokenizer.from_pretrained(f"{trainer_dir}")
-        texts = []
-        with open(data_path, "r") as f:
-            for line in f:
-                item = json.loads(line)
-                texts.append(item["text"])
+        tokenizer = MobileBertTokenizerFast.from_pretrained(f"{trainer_dir}")
         logger.info("Generating pseudo-labels with pre-trained model...")
         model = MobileBertForSequenceClassification.from_pretrained(f"{trainer_dir}")
         model.to(device)
-        confident_texts, pseudo_labels = generate_pseudo_labels(model, tokenizer, texts, device,0.9)
-        if len(confident_texts) == 0:
-            logger.warning("No confident pseudo-labels generated. Aborting retraining.")
+        shard_paths, total = generate_pseudo_labels(model, tokenizer, data_path, device, 0.9)
+        if total == 0:
+            logger.warning("No new feedback to pseudo-label. Skipping retraining.")
             return
-        logger.info(f"Retained {len(confident_texts)} out of {len(texts)} samples for retraining.")
-        retrain_dataset = TextDataset(confident_texts, pseudo_labels, tokenizer, num_classes=5, max_length=256)
+        logger.info(f"Retained {total} samples for retraining.")
+        if feedback_state is not None:
+            record_pseudo_labels(feedback_state, shard_paths)
+            replay_path = write_replay_shard(feedback_state, total)
+            if replay_path:
+                shard_paths.append(replay_path)
+        # Shards are converted to a memory-mapped Arrow dataset rather than loaded into Python lists
+        pseudo_labeled = load_dataset("json", data_files=shard_paths, split="train")
+        retrain_dataset = tokenize_dataset(pseudo_labeled, tokenizer, "text", "feedback")
 
         retrain_args = TrainingArguments(
             output_dir=f"{result_dir}",
@@ -194,32 +537,211 @@ def train_model(data_path, is_initial_training):
             num_train_epochs=3,
             logging_dir=f"{logs_dir}",
             logging_steps=1000,
+            group_by_length=True,
+            length_column_name="length",
         )
 
         retrainer = Trainer(
             model=model,
             args=retrain_args,
-            train_dataset=retrain_dataset
+            train_dataset=retrain_dataset,
+            data_collator=DataCollatorWithPadding(tokenizer)
         )
         retrainer.train()
 
         retrain_model_dir = f"{trainer_dir}"
-        model.save_pretrained(retrain_model_dir)
+        model.save_pretrained(retrain_model_dir, safe_serialization=True)
         tokenizer.save_pretrained(retrain_model_dir)
-        for file_name in os.listdir(retrain_model_dir):
-            local_file_path = os.path.join(retrain_model_dir, file_name)
-            s3_key = f"{MODEL_PATH}{file_name}"
-            s3_client.upload_file(local_file_path, S3_BUCKET, s3_key)
-            logger.info(f"Uploaded {local_file_path} to s3://{S3_BUCKET}/{s3_key}")
+        publish_model(retrain_model_dir)
+        if feedback_state is not None:
+            mark_feedback_trained(feedback_state)
 
         logger.info(f"Fine-tuned model saved to {retrain_model_dir}")
         return
 
+# Prefixes one level below `prefix`, e.g. the per-pod segment prefixes
+def list_s3_prefixes(prefix):
+    prefixes = []
+    kwargs = {"Bucket": S3_BUCKET, "Prefix": prefix, "Delimiter": "/"}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        prefixes.extend(entry["Prefix"] for entry in response.get("CommonPrefixes", []))
+        if not response.get("IsTruncated"):
+            return prefixes
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+# Retraining state. `feedback.status` is 'pending' until a retraining run that included the record
+# has published its model, so a failed run leaves its records for the next one.
+def open_feedback_state():
+    conn = sqlite3.connect(feedback_state_file)
+    conn.execute("CREATE TABLE IF NOT EXISTS consumed_segments (key TEXT PRIMARY KEY, consumed_at REAL)")
+    # Segments listed in a manifest but gone from S3; never looked for again
+    conn.execute("CREATE TABLE IF NOT EXISTS missing_segments (key TEXT PRIMARY KEY, missing_at REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS feedback (hash TEXT PRIMARY KEY, text TEXT, stars INTEGER, "
+                 "label INTEGER, status TEXT, first_seen REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS feedback_status ON feedback (status)")
+    conn.commit()
+    return conn
+
+# Same normalization as the inference cache: case and whitespace differences are duplicates
+def feedback_hash(text):
+    return hashlib.sha256(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+
+# Download the segments listed in every pod manifest that have not been consumed yet. Only the
+# pod prefixes and their manifests are read, so a run does not list every segment ever uploaded.
+def download_feedback_segments(conn):
+    consumed = {key for (key,) in conn.execute(
+        "SELECT key FROM consumed_segments UNION SELECT key FROM missing_segments")}
+    new_segments = []
+    missing = 0
+    for pod_prefix in list_s3_prefixes(SEGMENT_PATH):
+        manifest_key = f"{pod_prefix}{MANIFEST_NAME}"
+        manifest = get_json_object(manifest_key)
+        if manifest is None:
+            continue
+        for segment in manifest["segments"]:
+            if segment["key"] in consumed:
+                continue
+            local_path = os.path.join(segments_dir, *segment["key"][len(SEGMENT_PATH):].split("/"))
+            if not os.path.exists(local_path):
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                try:
+                    s3_client.download_file(S3_BUCKET, segment["key"], f"{local_path}.part")
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                        raise
+                    # Recorded, so a segment that is gone does not stop every later run at the same place
+                    logger.warning(f"Feedback segment {segment['key']} listed in {manifest_key} is missing, skipping it.")
+                    with conn:
+                        conn.execute("INSERT OR IGNORE INTO missing_segments (key, missing_at) VALUES (?, ?)",
+                                     (segment["key"], time.time()))
+                    missing += 1
+                    continue
+                os.replace(f"{local_path}.part", local_path)
+                logger.info(f"Downloaded feedback segment {segment['key']}")
+            new_segments.append((segment["key"], local_path))
+    logger.info(f"{len(new_segments)} new feedback segments, {missing} missing, {len(consumed)} already consumed.")
+    return new_segments
+
+# Records of a gzip JSONL segment; a truncated segment contributes the lines before the damage
+def iter_segment_records(path):
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, zlib.error, json.JSONDecodeError):
+            logger.warning(f"Segment {path} is truncated, using the records before the damage.")
+
+def iter_jsonl_records(path):
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# Add records not seen before as pending; returns (records read, new records)
+def stage_feedback(conn, records):
+    read = 0
+    before = conn.total_changes
+    batch = []
+    for record in records:
+        read += 1
+        batch.append((feedback_hash(record["text"]), record["text"], record.get("stars"), time.time()))
+        if len(batch) >= STAGE_BATCH_SIZE:
+            conn.executemany("INSERT OR IGNORE INTO feedback (hash, text, stars, status, first_seen) "
+                             "VALUES (?, ?, ?, 'pending', ?)", batch)
+            batch = []
+    conn.executemany("INSERT OR IGNORE INTO feedback (hash, text, stars, status, first_seen) "
+                     "VALUES (?, ?, ?, 'pending', ?)", batch)
+    return read, conn.total_changes - before
+
+# Stage each segment and advance the watermark in one transaction, then drop the local copy
+def stage_feedback_segments(conn, segments):
+    for key, path in segments:
+        with conn:
+            read, new = stage_feedback(conn, iter_segment_records(path))
+            conn.execute("INSERT OR IGNORE INTO consumed_segments (key, consumed_at) VALUES (?, ?)", (key, time.time()))
+        os.remove(path)
+        logger.info(f"Staged {new} new of {read} records from {key}")
+
+# MinHash index from file_processing/near_duplicates.py, or None when the pass is disabled
+def near_duplicate_index():
+    if NEAR_DUPLICATE_THRESHOLD <= 0:
+        return None
+    sys.path.append(os.path.join(REPO_ROOT, "file_processing"))
+    from near_duplicates import NearDuplicateIndex
+    return NearDuplicateIndex(threshold=NEAR_DUPLICATE_THRESHOLD)
+
+# Write the pending (not yet trained on) records to the retraining input file. Near-duplicates
+# are marked 'duplicate' so they are neither trained on nor replayed later.
+def export_pending_feedback(conn, dataset):
+    index = near_duplicate_index()
+    count = 0
+    duplicates = []
+    with open(dataset, "w") as out:
+        for rowid, text, stars in conn.execute("SELECT rowid, text, stars FROM feedback WHERE status = 'pending'"):
+            if index is not None and not index.add_if_unique(text):
+                duplicates.append((rowid,))
+                continue
+            out.write(json.dumps({"text": text, "stars": stars}) + "\n")
+            count += 1
+    if duplicates:
+        with conn:
+            conn.executemany("UPDATE feedback SET status = 'duplicate' WHERE rowid = ?", duplicates)
+        logger.info(f"Skipped {len(duplicates)} near-duplicate pending feedback records.")
+    logger.info(f"Exported {count} pending feedback records to {dataset}")
+    return count
+
+def record_pseudo_labels(conn, shard_paths):
+    with conn:
+        for path in shard_paths:
+            conn.executemany("UPDATE feedback SET label = ? WHERE hash = ?",
+                             ((record["label"], feedback_hash(record["text"])) for record in iter_jsonl_records(path)))
+
+# Sample earlier, already trained-on records with their stored labels into an extra shard
+def write_replay_shard(conn, new_records):
+    sample_size = int(new_records * REPLAY_FRACTION)
+    if sample_size <= 0:
+        return None
+    rowids = [rowid for (rowid,) in conn.execute(
+        "SELECT rowid FROM feedback WHERE status = 'trained' AND label IS NOT NULL")]
+    sample = random.sample(rowids, min(sample_size, len(rowids)))
+    if not sample:
+        return None
+    replay_path = os.path.join(pseudo_label_dir, "replay.jsonl")
+    with open(replay_path, "w") as out:
+        for start in range(0, len(sample), STAGE_BATCH_SIZE):
+            chunk = sample[start:start + STAGE_BATCH_SIZE]
+            rows = conn.execute(f"SELECT text, label FROM feedback WHERE rowid IN ({','.join('?' * len(chunk))})", chunk)
+            for text, label in rows:
+                out.write(json.dumps({"text": text, "label": label, "source": "replay"}) + "\n")
+    logger.info(f"Added {len(sample)} replayed records to the retraining set.")
+    return replay_path
+
+def mark_feedback_trained(conn):
+    with conn:
+        updated = conn.execute("UPDATE feedback SET status = 'trained' WHERE status = 'pending'").rowcount
+    logger.info(f"Marked {updated} feedback records as trained.")
+
 def main():
+    # Distillation only needs the published teacher (fetched through the latest pointer) and the public corpus
+    if TRAINING_MODE == "distill":
+        distill_model()
+        return
     data_path = f"{dataset_dir}"
     dataset = os.path.join(data_path, "inputFile.jsonl")
+    feedback_state = open_feedback_state()
     try:
-        s3_client.download_file(S3_BUCKET, f"{NEW_DATA_PATH}inputFile.jsonl", dataset)
+        new_segments = download_feedback_segments(feedback_state)
+        if new_segments:
+            stage_feedback_segments(feedback_state, new_segments)
+        elif not feedback_state.execute("SELECT 1 FROM consumed_segments LIMIT 1").fetchone():
+            # Legacy single-file upload, deduplicated against everything staged before
+            legacy_file = os.path.join(data_path, "legacyInputFile.jsonl")
+            s3_client.download_file(S3_BUCKET, f"{NEW_DATA_PATH}inputFile.jsonl", legacy_file)
+            with feedback_state:
+                read, new = stage_feedback(feedback_state, iter_jsonl_records(legacy_file))
+            logger.info(f"Staged {new} new of {read} records from the legacy input file")
     except ClientError as e:
         if e.response["Error"]["Code"] == "404":
             logger.error("File not found in S3 (404). Skipping download.")
@@ -229,8 +751,9 @@ def main():
     except Exception as ex:
         logger.error(f"Unexpected error occured: {ex}")
         raise
+    export_pending_feedback(feedback_state, dataset)
     is_initial_training = True  # Set this flag to False for retraining
-    train_model(dataset, is_initial_training)
+    train_model(dataset, is_initial_training, feedback_state)
 
 if __name__ == "__main__":
     main()